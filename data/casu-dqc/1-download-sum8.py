@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""Downloads all *.sum8 and *.list files at Cambridge under ~/mike/uvex.
+
+Only files which changed since the previous download are transferred (see
+`mirror.py`).  The months in which files changed are printed, one per line.
+"""
+import os
+
+from astropy import log
+
+import mirror
+
+
+URL = "http://apm3.ast.cam.ac.uk/~mike/uvex/"
+DESTINATION = "downloaded"
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Mirrors the CASU sum8 and list files.")
+    parser.add_argument("--url", default=URL,
+                        help="root of the tree to mirror (default: %(default)s)")
+    parser.add_argument("--destination", default=DESTINATION,
+                        help="local directory (default: %(default)s)")
+    parser.add_argument("-c", "--connections", type=int, default=mirror.CONNECTIONS,
+                        help="number of concurrent requests")
+    parser.add_argument("--delay", type=float, default=mirror.DELAY,
+                        help="minimum number of seconds between requests")
+    args = parser.parse_args()
+    m = mirror.Mirror(args.url, args.destination,
+                      connections=args.connections, delay=args.delay,
+                      user=os.environ.get('UVEXUSER'),
+                      password=os.environ.get('UVEXPASSWD'))
+    changed = m.run()
+    log.info("{} months changed".format(len(changed)))
+    for month in changed:
+        print(month)
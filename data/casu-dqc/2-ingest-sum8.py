@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""Reads the downloaded summary.sum8 and summary.list files into a single
+by-run table, including the limiting magnitudes.
+
+Each month is parsed into its own partition in `tmp/partitions`, and only
+the months whose files changed since the previous run are parsed again;
+the partitions are then merged.  This replaces concatenating the files,
+fixing the alternative fixed-width layout, converting the result to CSV,
+extracting the limiting magnitudes and joining them onto the table.
+
+This script produces `tmp/uvex-casu-dqc-by-run-with-lm.fits`.
+"""
+from astropy import log
+
+import sum8
+
+
+ROOT = "downloaded/apm3.ast.cam.ac.uk/~mike/uvex"
+PARTITION_DIR = "tmp/partitions"
+OUTPUT_FN = "tmp/uvex-casu-dqc-by-run-with-lm.fits"
+
+
+if __name__ == '__main__':
+    changed = sum8.update_partitions(ROOT, PARTITION_DIR)
+    log.info("Parsed {} changed months: {}".format(len(changed),
+                                                   ' '.join(changed)))
+    table = sum8.merge_partitions(PARTITION_DIR)
+    log.info("Writing {} runs to {}".format(len(table), OUTPUT_FN))
+    table.write(OUTPUT_FN, overwrite=True)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""Derives the positions and field names of the runs in the CASU DQC table.
+
+This script produces `uvex-casu-dqc-by-run.fits`, containing the UVEX runs
+of `tmp/uvex-casu-dqc-by-run-with-lm.fits` with the following extra columns:
+runno, ra, dec (degrees), l, b (galactic, degrees) and field.
+"""
+import os
+import sys
+
+import numpy as np
+from astropy import log
+from astropy.table import Table
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import derive
+
+
+INPUT_FN = "tmp/uvex-casu-dqc-by-run-with-lm.fits"
+OUTPUT_FN = "uvex-casu-dqc-by-run.fits"
+
+
+def convert(t):
+    """Returns the UVEX runs of a by-run table with the derived columns."""
+    t['name'] = np.char.lower(np.asarray(t['name'], dtype=str))
+    t = t[np.char.startswith(t['name'], 'uvex')]
+    runs = np.char.strip(np.asarray(t['run'], dtype=str))
+    t.add_column(np.char.lstrip(runs, 'r').astype(int), name='runno',
+                 index=t.colnames.index('run'))
+    ra = derive.hms_to_degrees(t['ra_hms'])
+    dec = derive.dms_to_degrees(t['dec_dms'])
+    t.add_column(ra, name='ra', index=t.colnames.index('ra_hms'))
+    t.add_column(dec, name='dec', index=t.colnames.index('ra_hms'))
+    t['l'], t['b'] = derive.galactic(ra, dec)
+    t['field'] = derive.field_names(t['name'])
+    return t
+
+
+if __name__ == '__main__':
+    t = convert(Table.read(INPUT_FN))
+    log.info("Writing {} runs to {}".format(len(t), OUTPUT_FN))
+    t.write(OUTPUT_FN, overwrite=True)
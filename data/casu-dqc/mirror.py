@@ -0,0 +1,239 @@
+"""Mirrors selected files from a web directory tree, like `wget --mirror`.
+
+Directory listings are crawled and files are downloaded over several
+connections at once, with a minimum delay between the start of any two
+requests to be polite to the server.  Files which were downloaded before
+are requested conditionally, using the ETag and Last-Modified headers
+stored in a state file, so unchanged files cost a "304 Not Modified"
+response rather than a transfer.
+
+Files are stored as `<destination>/<host>/<path>`, as wget does, with the
+modification time given by the server.
+"""
+import os
+import sys
+import json
+import email.utils
+from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlparse, unquote
+from urllib.request import (build_opener, HTTPBasicAuthHandler,
+                            HTTPPasswordMgrWithDefaultRealm, Request)
+
+from astropy import log
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ratelimit import RateLimiter
+
+
+STATE_FN = '.mirror-state.json'
+CONNECTIONS = 4  # Number of concurrent requests
+DELAY = 0.2  # Minimum number of seconds between the start of two requests
+TIMEOUT = 60  # Seconds
+
+
+class LinkParser(HTMLParser):
+    """Collects the targets of the links in an HTML page."""
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            for name, value in attrs:
+                if name == 'href' and value:
+                    self.links.append(value)
+
+
+class Mirror(object):
+    """
+    Mirrors the files below a URL whose names end with given suffixes.
+
+    Parameters
+    ----------
+    url : str
+        Root of the tree to mirror; links outside it are not followed.
+
+    destination : str
+        Local directory in which to store the files.
+
+    accept : tuple of str
+        Suffixes of the files to download.
+
+    connections : int
+        Number of concurrent requests.
+
+    delay : float
+        Minimum number of seconds between the start of two requests.
+
+    user, password : str
+        Credentials for HTTP basic authentication, if required.
+    """
+
+    def __init__(self, url, destination, accept=('.sum8', '.list'),
+                 connections=CONNECTIONS, delay=DELAY,
+                 user=None, password=None):
+        self.url = url if url.endswith('/') else url + '/'
+        self.destination = destination
+        self.accept = tuple(accept)
+        self.connections = connections
+        self.limiter = RateLimiter(delay)
+        handlers = []
+        if user is not None:
+            passwords = HTTPPasswordMgrWithDefaultRealm()
+            passwords.add_password(None, self.url, user, password)
+            handlers.append(HTTPBasicAuthHandler(passwords))
+        self.opener = build_opener(*handlers)
+        self.state_fn = os.path.join(destination, STATE_FN)
+
+    def _open(self, url, headers={}):
+        """Sends a GET request, respecting the politeness delay."""
+        self.limiter.wait()
+        return self.opener.open(Request(url, headers=headers), timeout=TIMEOUT)
+
+    def local_path(self, url):
+        """Returns where a URL is stored."""
+        parsed = urlparse(url)
+        return os.path.join(self.destination, parsed.netloc,
+                            unquote(parsed.path).lstrip('/'))
+
+    def month(self, url):
+        """Returns the first directory below the root, e.g. 'aug2010'."""
+        return url[len(self.url):].split('/')[0]
+
+    def list_directory(self, url):
+        """Returns the subdirectories and accepted files in a listing."""
+        with self._open(url) as response:
+            page = response.read().decode('utf-8', 'replace')
+        parser = LinkParser()
+        parser.feed(page)
+        subdirs, files = set(), set()
+        for link in parser.links:
+            target = urljoin(url, link).split('#')[0]
+            # Skip parent directories, other sites and sorting links
+            if not target.startswith(url) or target == url or '?' in target:
+                continue
+            if target.endswith('/'):
+                subdirs.add(target)
+            elif target.endswith(self.accept):
+                files.add(target)
+        return sorted(subdirs), sorted(files)
+
+    def fetch(self, url, previous):
+        """Downloads a file unless it is unchanged.
+
+        Parameters
+        ----------
+        previous : dict
+            The 'etag' and 'last_modified' headers of the previous download.
+
+        Returns
+        -------
+        state : dict
+            The headers of the current version, or None if the download
+            failed.
+
+        changed : bool
+            True if the file was (re)downloaded with different contents.
+        """
+        path = self.local_path(url)
+        headers = {}
+        if os.path.exists(path):
+            if previous.get('etag'):
+                headers['If-None-Match'] = previous['etag']
+            if previous.get('last_modified'):
+                headers['If-Modified-Since'] = previous['last_modified']
+        try:
+            with self._open(url, headers) as response:
+                content = response.read()
+                state = {'etag': response.headers.get('ETag'),
+                         'last_modified': response.headers.get('Last-Modified')}
+        except HTTPError as e:
+            if e.code == 304:
+                return previous, False
+            log.warning("{}: {}".format(url, e))
+            return None, False
+
+        try:
+            with open(path, 'rb') as fh:
+                changed = fh.read() != content
+        except (IOError, OSError):
+            changed = True
+        if changed:
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass  # dir exists
+            tmpfile = path + '.tmp'
+            with open(tmpfile, 'wb') as fh:
+                fh.write(content)
+            os.rename(tmpfile, path)
+        if changed and state['last_modified']:
+            mtime = email.utils.mktime_tz(
+                        email.utils.parsedate_tz(state['last_modified']))
+            os.utime(path, (mtime, mtime))
+        return state, changed
+
+    def read_state(self):
+        """Returns {url: headers} of the previous run."""
+        try:
+            with open(self.state_fn) as fh:
+                return json.load(fh)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def write_state(self, state):
+        """Saves {url: headers} for the next run."""
+        try:
+            os.makedirs(self.destination)
+        except OSError:
+            pass  # dir exists
+        tmpfile = self.state_fn + '.tmp'
+        with open(tmpfile, 'w') as fh:
+            json.dump(state, fh, indent=1, sort_keys=True)
+        os.rename(tmpfile, self.state_fn)
+
+    def run(self):
+        """Mirrors the tree.
+
+        Returns
+        -------
+        changed : list of str
+            The months in which files were added or changed.
+        """
+        old_state = self.read_state()
+        state, changed = {}, set()
+        with ThreadPoolExecutor(max_workers=self.connections) as pool:
+            pending = {pool.submit(self.list_directory, self.url):
+                       ('dir', self.url)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, url = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        log.warning("{}: {}".format(url, e))
+                        continue
+                    if kind == 'dir':
+                        subdirs, files = result
+                        for subdir in subdirs:
+                            pending[pool.submit(self.list_directory, subdir)] = \
+                                ('dir', subdir)
+                        for fileurl in files:
+                            previous = old_state.get(fileurl, {})
+                            pending[pool.submit(self.fetch, fileurl, previous)] = \
+                                ('file', fileurl)
+                    else:
+                        file_state, file_changed = result
+                        if file_state is None:  # keep trying conditionally
+                            file_state = old_state.get(url)
+                        if file_state is not None:
+                            state[url] = file_state
+                        if file_changed:
+                            log.info("Updated {}".format(url))
+                            changed.add(self.month(url))
+        self.write_state(state)
+        return sorted(changed)
@@ -0,0 +1,212 @@
+"""Parses the fixed-width `summary.sum8` data quality files produced by CASU.
+
+Each observing month has a `<month>/dqcinfo/summary.sum8` file with one
+line per run, and a `summary.list` file with the limiting magnitude of
+every CCD of every run.  The sum8 lines come in two fixed-width layouts,
+one of which has two extra characters after the filter column; these are
+removed so that all lines share the same column positions.  The columns are then sliced out
+of all the lines at once by viewing them as a two-dimensional byte array.
+"""
+import os
+import re
+import sys
+
+import numpy as np
+from astropy import log
+from astropy.io import fits
+from astropy.table import Table, vstack
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from derive import to_float
+
+
+# (name, first character, last character, dtype) in the normalised layout
+COLUMNS = [('run', 0, 14, str),
+           ('name', 16, 32, str),
+           ('ra_hms', 34, 44, str),
+           ('dec_dms', 46, 56, str),
+           ('airmass', 64, 68, float),
+           ('posang', 70, 74, float),
+           ('time', 76, 96, str),
+           ('exptime', 98, 104, float),
+           ('filter', 107, 109, str),
+           ('seeing', 111, 114, float),
+           ('sky', 116, 122, float),
+           ('noise', 124, 128, float),
+           ('ellipt', 130, 134, float),
+           ('apcor', 136, 140, float),
+           ('comments', 142, 157, str)]
+# Lines of this length use the alternative layout
+LONG_LINE_LENGTH = 158
+LONG_LINE_EXTRA = slice(111, 113)
+# Lines of summary.list start with the run, e.g. "r123456_1", and end with
+# the limiting magnitude
+LIST_PATTERN = re.compile(br'^(r[^_]+).*\s(\S+)$')
+
+
+def find_summary_files(root, name="summary.sum8"):
+    """Returns {month: path} for all the summary files below `root`,
+    where the month is the name of the directory above `dqcinfo`."""
+    result = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        if name in filenames:
+            month = os.path.basename(os.path.dirname(dirpath))
+            result[month] = os.path.join(dirpath, name)
+    return result
+
+
+def read_lines(filename):
+    """Returns the data lines of a summary file as a list of bytes."""
+    with open(filename, 'rb') as fh:
+        lines = fh.read().splitlines()
+    # The header line contains "Run"; blank lines are ignored
+    return [line for line in lines if line.strip() and b'Run' not in line]
+
+
+def parse_lines(lines, dirs):
+    """Parses sum8 data lines into a by-run table.
+
+    Parameters
+    ----------
+    lines : list of bytes
+        Data lines in either of the two layouts.
+
+    dirs : list of str
+        The month directory of every line.
+
+    Returns
+    -------
+    table : `~astropy.table.Table`
+    """
+    width = max([len(line) for line in lines] + [COLUMNS[-1][2] + 1])
+    chars = np.array(lines, dtype='S{}'.format(width))
+    chars = chars.view('S1').reshape(len(lines), width)
+    # Bring the alternative layout in line with the common one
+    lengths = np.array([len(line) for line in lines])
+    long_lines = lengths == LONG_LINE_LENGTH
+    if long_lines.any():
+        keep = np.ones(width, dtype=bool)
+        keep[LONG_LINE_EXTRA] = False
+        chars[long_lines, :keep.sum()] = chars[long_lines][:, keep]
+        chars[long_lines, keep.sum():] = b' '
+    chars[chars == b''] = b' '  # Padding of short lines
+
+    table = Table()
+    table['dir'] = np.array(dirs, dtype=str)
+    for name, start, end, dtype in COLUMNS:
+        column = np.ascontiguousarray(chars[:, start:end + 1])
+        column = np.char.strip(column.view('S{}'.format(end + 1 - start))[:, 0])
+        if dtype is float:
+            table[name] = to_float(column)
+        else:
+            table[name] = np.char.decode(column, 'ascii', 'replace')
+    return table
+
+
+def read_limiting_mags(filename):
+    """Returns the runs in a summary.list file and their limiting
+    magnitudes, averaged over the CCDs.
+
+    Returns
+    -------
+    runs : array of str
+
+    lm : array of float
+    """
+    runs, values = [], []
+    with open(filename, 'rb') as fh:
+        for line in fh.read().splitlines():
+            match = LIST_PATTERN.match(line)
+            if match:
+                runs.append(match.group(1).decode('ascii', 'replace'))
+                values.append(match.group(2))
+    runs, inverse = np.unique(np.array(runs, dtype=str), return_inverse=True)
+    values = to_float(np.array(values, dtype=bytes))
+    # NaN values are ignored in the average
+    ok = np.isfinite(values)
+    count = np.bincount(inverse[ok], minlength=len(runs))
+    total = np.bincount(inverse[ok], weights=values[ok], minlength=len(runs))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return runs, total / count
+
+
+def ingest_month(month, sum8_fn, list_fn=None):
+    """Returns the by-run table of one month, including the limiting
+    magnitudes from its summary.list file if given."""
+    lines = read_lines(sum8_fn)
+    table = parse_lines(lines, [month] * len(lines))
+    table['lm'] = np.full(len(table), np.nan)
+    if list_fn is not None:
+        runs, lm = read_limiting_mags(list_fn)
+        if len(runs) > 0:
+            idx = np.clip(np.searchsorted(runs, table['run']), 0, len(runs) - 1)
+            found = runs[idx] == table['run']
+            table['lm'][found] = lm[idx[found]]
+    return table
+
+
+def fingerprint(filename):
+    """Returns a string which changes when a file is modified."""
+    if filename is None:
+        return ''
+    stat = os.stat(filename)
+    return '{}-{}'.format(stat.st_size, stat.st_mtime_ns)
+
+
+def update_partitions(root, partdir):
+    """Parses the months whose summary files changed into per-month tables.
+
+    Every partition `<partdir>/<month>.fits` records the fingerprints of
+    the files it was made from in its SOURCES keyword; months whose files
+    are unchanged are not parsed again.
+
+    Returns
+    -------
+    changed : list of str
+        The months which were (re)parsed.
+    """
+    sum8_files = find_summary_files(root, "summary.sum8")
+    list_files = find_summary_files(root, "summary.list")
+    try:
+        os.makedirs(partdir)
+    except OSError:
+        pass  # dir exists
+
+    changed = []
+    for month, sum8_fn in sorted(sum8_files.items()):
+        list_fn = list_files.get(month)
+        sources = '{},{}'.format(fingerprint(sum8_fn), fingerprint(list_fn))
+        partition = os.path.join(partdir, month + '.fits')
+        try:
+            if fits.getval(partition, 'SOURCES', ext=1) == sources:
+                continue
+        except (IOError, OSError, KeyError):
+            pass  # no partition yet
+        log.info("Parsing {}".format(month))
+        table = ingest_month(month, sum8_fn, list_fn)
+        table.meta['SOURCES'] = sources
+        # Write to a temporary file first, such that an interrupted update
+        # never leaves a partition which looks up to date
+        tmpfile = partition + '.tmp'
+        table.write(tmpfile, format='fits', overwrite=True)
+        os.rename(tmpfile, partition)
+        changed.append(month)
+
+    # Remove the partitions of months which are no longer downloaded
+    for filename in os.listdir(partdir):
+        month, ext = os.path.splitext(filename)
+        if ext == '.fits' and month not in sum8_files:
+            log.info("Removing {}".format(month))
+            os.remove(os.path.join(partdir, filename))
+    return changed
+
+
+def merge_partitions(partdir):
+    """Returns the by-run table of all months, sorted by run."""
+    tables = [Table.read(os.path.join(partdir, filename))
+              for filename in sorted(os.listdir(partdir))
+              if filename.endswith('.fits')]
+    table = vstack(tables, metadata_conflicts='silent')
+    table.meta.pop('SOURCES', None)
+    table.sort('run')
+    return table
@@ -0,0 +1,114 @@
+"""Vectorized column derivations shared by the table conversion scripts.
+
+These replace the STILTS expressions `hmsToDegrees`, `dmsToDegrees`,
+`addskycoords` and the string splitting of exposure names, operating on
+whole columns at once rather than row by row.
+"""
+import numpy as np
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+
+
+def to_float(column):
+    """Converts an array of (byte) strings to floats; unparsable values
+    become NaN."""
+    column = np.asarray(column)
+    if column.dtype.kind not in 'SU':
+        column = column.astype(str)
+    column = np.char.strip(column)
+    try:
+        return column.astype(float)
+    except ValueError:
+        result = np.full(len(column), np.nan)
+        for i, value in enumerate(column):
+            try:
+                result[i] = float(value)
+            except ValueError:
+                pass
+        return result
+
+
+def sexagesimal_to_degrees(column, scale=1.):
+    """Converts 'DD:MM:SS.S' (or 'DD MM SS.S') strings to decimal degrees.
+
+    Parameters
+    ----------
+    column : array of str
+
+    scale : float
+        Factor by which to multiply the result, i.e. 15 for hours.
+
+    Returns
+    -------
+    degrees : array of float
+        NaN where the string could not be parsed.
+    """
+    column = np.char.strip(np.asarray(column, dtype=str))
+    column = np.char.replace(column, ' ', ':')
+    negative = np.char.startswith(column, '-')
+    column = np.char.lstrip(column, '+-')
+    first = np.char.partition(column, ':')
+    second = np.char.partition(first[:, 2], ':')
+    value = (to_float(first[:, 0])
+             + to_float(second[:, 0]) / 60.
+             + np.where(second[:, 2] == '', 0., to_float(second[:, 2])) / 3600.)
+    return np.where(negative, -value, value) * scale
+
+
+def hms_to_degrees(column):
+    """Converts right ascensions in 'HH:MM:SS.S' to decimal degrees."""
+    return sexagesimal_to_degrees(column, scale=15.)
+
+
+def dms_to_degrees(column):
+    """Converts declinations in 'DD:MM:SS.S' to decimal degrees."""
+    return sexagesimal_to_degrees(column)
+
+
+def galactic(ra, dec):
+    """Returns the galactic longitude and latitude of ICRS positions in degrees."""
+    coords = SkyCoord(np.asarray(ra) * u.deg, np.asarray(dec) * u.deg,
+                      frame='icrs').galactic
+    return coords.l.deg, coords.b.deg
+
+
+def split_part(column, separator, index):
+    """Returns `s.split(separator)[index]` for every string in a column,
+    or '' where there are not enough parts."""
+    parts = np.asarray(column, dtype=str)
+    for _ in range(index):
+        parts = np.char.partition(parts, separator)[:, 2]
+    return np.char.partition(parts, separator)[:, 0]
+
+
+def field_names(names):
+    """Returns the field identifiers of exposure names, e.g. '4084o' for
+    'uvex_4084o r'."""
+    return np.char.strip(split_part(split_part(names, '_', 1), ' ', 0))
+
+
+def filter_names(names):
+    """Returns the filters of exposure names, e.g. 'r' for 'uvex_4084o r'."""
+    return np.char.strip(split_part(names, ' ', 1))
+
+
+def prefixes(names, separator='_'):
+    """Returns the part of every name before the first separator, e.g.
+    'uvex' for 'uvex_4084o r', or '' if there is no separator."""
+    parts = np.char.partition(np.asarray(names, dtype=str), separator)
+    return np.where(parts[:, 1] == separator, parts[:, 0], '')
+
+
+def anti_join(keys, other):
+    """Returns a boolean mask which is True where an integer key does not
+    occur in `other`.
+
+    The keys are looked up in the sorted unique values of `other` with a
+    binary search, i.e. a sorted merge rather than a pairwise comparison.
+    """
+    keys = np.asarray(keys)
+    other = np.unique(np.asarray(other))
+    if len(other) == 0:
+        return np.ones(len(keys), dtype=bool)
+    idx = np.clip(np.searchsorted(other, keys), 0, len(other) - 1)
+    return other[idx] != keys
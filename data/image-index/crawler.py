@@ -0,0 +1,185 @@
+"""Parallel, incremental crawler of the FITS files in the reduced data tree.
+
+The crawler lists directories with `os.scandir` on a pool of threads, and
+stores what it found in the `dirs`, `files` and `subdirs` tables of the image
+index:
+
+ * `dirs(path TEXT PRIMARY KEY, parent TEXT, mtime INTEGER)`
+ * `files(path TEXT PRIMARY KEY, dir TEXT)`
+ * `subdirs(path TEXT PRIMARY KEY, dir TEXT)`
+
+A directory's mtime only changes when entries are added to or removed from
+the directory itself.  On a rescan, directories whose mtime is unchanged
+are therefore not listed again: their files and subdirectories are taken
+from the index, and only the subdirectories are stat'ed in turn.  The
+`subdirs` table records every subdirectory found in a listing, including
+those which could not be listed themselves, such that these are retried
+on the next crawl.  Symbolic links to directories are followed, except
+when they point back to one of their own ancestors.
+"""
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from astropy import log
+
+from imageindex import INDEX_FN
+
+
+EXTENSIONS = ("fit", "fits", "fit.fz", "fits.fz")
+THREADS = 16  # Number of directories listed concurrently
+
+
+def _create_tables(conn):
+    new = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                       "AND name = 'subdirs'").fetchone() is None
+    conn.execute("CREATE TABLE IF NOT EXISTS dirs "
+                 "(path TEXT PRIMARY KEY, parent TEXT, mtime INTEGER)")
+    conn.execute("CREATE TABLE IF NOT EXISTS files "
+                 "(path TEXT PRIMARY KEY, dir TEXT NOT NULL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS files_dir ON files (dir)")
+    conn.execute("CREATE TABLE IF NOT EXISTS subdirs "
+                 "(path TEXT PRIMARY KEY, dir TEXT NOT NULL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS subdirs_dir ON subdirs (dir)")
+    if new:
+        # The subdirectories of an older index are unknown, so all of its
+        # directories have to be listed again
+        conn.execute("UPDATE dirs SET mtime = NULL")
+
+
+class Crawler(object):
+    """
+    Crawls a directory tree, reusing the listings of unchanged directories.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the SQLite database in which the listings are stored.
+
+    threads : int
+        Number of directories listed concurrently.
+    """
+
+    def __init__(self, filename=INDEX_FN, threads=THREADS):
+        self.filename = filename
+        self.threads = threads
+
+    def _load(self):
+        """Returns the previous crawl as {dir: mtime}, {dir: [subdirs]}
+        and {dir: [files]}."""
+        mtimes, subdirs, files = {}, {}, {}
+        with sqlite3.connect(self.filename) as conn:
+            _create_tables(conn)
+            for path, parent, mtime in conn.execute("SELECT * FROM dirs"):
+                mtimes[path] = mtime
+            for path, mydir in conn.execute("SELECT * FROM subdirs"):
+                subdirs.setdefault(mydir, []).append(path)
+            for path, mydir in conn.execute("SELECT * FROM files"):
+                files.setdefault(mydir, []).append(path)
+        conn.close()
+        return mtimes, subdirs, files
+
+    def _scan(self, path, ancestors):
+        """Lists one directory, or reuses its previous listing.
+
+        Returns
+        -------
+        (inode, mtime, subdirs, files, changed), or None if the directory
+        is unreadable or a symbolic link loop.
+        """
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            log.warning("{}: {}".format(path, e))
+            return None
+        inode = (st.st_dev, st.st_ino)
+        if inode in ancestors:
+            log.warning("{}: symbolic link loop, skipped".format(path))
+            return None
+        mtime = st.st_mtime_ns
+        if self._mtimes.get(path) == mtime:
+            return (inode, mtime, self._subdirs.get(path, []),
+                    self._files.get(path, []), False)
+
+        log.info("Scanning " + path)
+        subdirs, files = [], []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=True):
+                            subdirs.append(entry.path)
+                        elif entry.name.endswith(EXTENSIONS):
+                            files.append(entry.path)
+                    except OSError:
+                        pass  # e.g. a broken symbolic link
+        except OSError as e:
+            log.warning("{}: {}".format(path, e))
+            return None
+        return (inode, mtime, subdirs, files, True)
+
+    def crawl(self, root):
+        """Crawls a directory tree and updates the index.
+
+        Returns
+        -------
+        stats : dict
+            Number of directories scanned and reused, and of files
+            added and removed.
+        """
+        self._mtimes, self._subdirs, self._files = self._load()
+        root = os.path.normpath(root)
+        result = {}  # Maps dirs onto (parent, mtime, subdirs, files, changed)
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            pending = {pool.submit(self._scan, root, frozenset()):
+                       (root, None, frozenset())}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, parent, ancestors = pending.pop(future)
+                    listing = future.result()
+                    if listing is None:
+                        continue
+                    inode, mtime, subdirs, files, changed = listing
+                    result[path] = (parent, mtime, subdirs, files, changed)
+                    ancestors = ancestors | {inode}
+                    for subdir in subdirs:
+                        future = pool.submit(self._scan, subdir, ancestors)
+                        pending[future] = (subdir, path, ancestors)
+
+        stats = {'scanned': 0, 'reused': 0, 'added': 0, 'removed': 0}
+        with sqlite3.connect(self.filename) as conn:
+            _create_tables(conn)
+            for path in set(self._mtimes) - set(result):
+                stats['removed'] += len(self._files.get(path, []))
+                conn.execute("DELETE FROM dirs WHERE path = ?", (path,))
+                conn.execute("DELETE FROM files WHERE dir = ?", (path,))
+                conn.execute("DELETE FROM subdirs WHERE dir = ?", (path,))
+            for path, (parent, mtime, subdirs, files, changed) in result.items():
+                if not changed:
+                    stats['reused'] += 1
+                    continue
+                stats['scanned'] += 1
+                old = set(self._files.get(path, []))
+                stats['added'] += len(set(files) - old)
+                stats['removed'] += len(old - set(files))
+                conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                             (path, parent, mtime))
+                conn.execute("DELETE FROM files WHERE dir = ?", (path,))
+                conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?)",
+                                 ((fn, path) for fn in files))
+                conn.execute("DELETE FROM subdirs WHERE dir = ?", (path,))
+                conn.executemany("INSERT OR REPLACE INTO subdirs VALUES (?, ?)",
+                                 ((subdir, path) for subdir in subdirs))
+        conn.close()
+        return stats
+
+
+def read_files(filename=INDEX_FN):
+    """Returns the paths of all the FITS files found by the crawler."""
+    with sqlite3.connect(filename) as conn:
+        _create_tables(conn)
+        paths = [row[0] for row in
+                 conn.execute("SELECT path FROM files ORDER BY path")]
+    conn.close()
+    return paths
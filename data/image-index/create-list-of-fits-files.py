@@ -1,20 +1,30 @@
 """Make a list of all the FITS files in the IPHAS/UVEX reduced data from CASU.
 
-The output is a CSV table with paths to the fits files.
+The files are found by `crawler.Crawler`, which only lists the directories
+that changed since the previous run, and are recorded in the `files` table
+of the image index.  The output is also written as a CSV table with paths
+to the fits files.
 """
-import os
 from astropy import log
 
+import crawler
+import imageindex
+
 # Config
 DATADIR = '/car-data/gb/iphas/'
 
 
 if __name__ == "__main__":
-    out = open('egaps-fits-files.csv', 'w')
-    for mydir in os.walk(DATADIR, followlinks=True):
-        log.info('Entering '+mydir[0])
-        for filename in mydir[2]:
-            if filename.endswith("fit") or filename.endswith("fits"):
-                out.write("{}\n".format(os.path.join(mydir[0], filename))) 
-        out.flush()
-    out.close()
+    import argparse
+    parser = argparse.ArgumentParser(description="Lists the FITS files in the reduced data.")
+    parser.add_argument("-t", "--threads", type=int, default=crawler.THREADS,
+                        help="number of directories listed concurrently")
+    args = parser.parse_args()
+
+    stats = crawler.Crawler(imageindex.INDEX_FN, threads=args.threads).crawl(DATADIR)
+    log.info("Scanned {scanned} directories and reused {reused}; "
+             "{added} files added, {removed} removed".format(**stats))
+    # Tile-compressed frames (.fz) are read directly by the quicklooks
+    with open('egaps-fits-files.csv', 'w') as out:
+        for path in crawler.read_files(imageindex.INDEX_FN):
+            out.write("{}\n".format(path))
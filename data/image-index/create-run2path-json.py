@@ -6,6 +6,9 @@ import json
 import numpy as np
 from astropy import log
 
+import crawler
+import imageindex
+
 
 OUTPUT_FN = "run2path.json"
 
@@ -15,18 +18,24 @@ DIRS_TO_IGNORE = ['junk', 'badones', 'crap', '9thoct', \
 if __name__ == "__main__":
     output = {}
 
-    with open("egaps-fits-files.csv", "r") as egapsfiles:
-        for entry in egapsfiles:
-            path = entry.strip()
-            # Some directories are ment to be disregarded
-            if np.any([d in path for d in DIRS_TO_IGNORE]):
+    # The file list is kept up to date by create-list-of-fits-files.py
+    for path in crawler.read_files(imageindex.INDEX_FN):
+        # Some directories are ment to be disregarded
+        if np.any([d in path for d in DIRS_TO_IGNORE]):
+            continue
+        filename = os.path.basename(path)
+        if re.match('^r\d+.fit', filename):
+            runno = filename.split('.')[0][1:]
+            #if runno in output:
+            #    log.warning("{}: duplicate:\n{}\n{}\n".format(runno, path, output[runno]))
+            # Prefer the uncompressed frame if both are present, because
+            # the casutools renderer has to funpack compressed frames first
+            if (path.endswith('.fz') and runno in output
+                    and not output[runno].endswith('.fz')):
                 continue
-            filename = os.path.basename(path)
-            if re.match('^r\d+.fit', filename):
-                runno = filename.split('.')[0][1:]
-                #if runno in output:
-                #    log.warning("{}: duplicate:\n{}\n{}\n".format(runno, path, output[runno]))
-                output[runno] = path
+            output[runno] = path
 
     log.info("Writing {}".format(OUTPUT_FN))
     json.dump(output, open(OUTPUT_FN, "w"), indent=2)
+    count = imageindex.write_run2path(output)
+    log.info("Updated {} rows in {}".format(count, imageindex.INDEX_FN))
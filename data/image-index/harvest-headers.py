@@ -0,0 +1,130 @@
+"""Harvest the FITS headers of all the runs in the image index.
+
+Only the header blocks of each frame are read: after every header, the
+size of the data unit is computed from the NAXISn, BITPIX, PCOUNT and
+GCOUNT keywords and skipped with a seek, so pixel data never leaves the
+disk.  The frames are read concurrently by a pool of threads.
+
+The output is a table with one row per run, named like the columns of
+`uvex-casu-dqc-by-run.fits` such that the two can be cross-checked.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from astropy import log
+from astropy.io import fits
+from astropy.table import Table
+
+import imageindex
+
+
+OUTPUT_FN = "headers-by-run.fits"
+THREADS = 16  # Number of frames read concurrently
+BLOCK_SIZE = 2880
+
+# Output columns: (name, dtype, primary header keywords to try in order)
+PRIMARY_COLUMNS = [('name', 'U40', ['OBJECT']),
+                   ('filter', 'U10', ['WFFBAND', 'FILTER']),
+                   ('date_obs', 'U10', ['DATE-OBS']),
+                   ('utstart', 'U12', ['UTSTART']),
+                   ('exptime', 'f4', ['EXPTIME']),
+                   ('airmass', 'f4', ['AIRMASS']),
+                   ('ra_hms', 'U16', ['RA']),
+                   ('dec_dms', 'U16', ['DEC'])]
+# Columns which are the median of a keyword over the CCD extensions
+CCD_COLUMNS = [('seeing', 'SEEING'),
+               ('ellipt', 'ELLIPTIC'),
+               ('sky', 'SKYLEVEL'),
+               ('noise', 'SKYNOISE')]
+PIXEL_SCALE = 0.333  # arcsec/pixel of the WFC; used if SECPPIX is missing
+
+COLUMNS = ([('runno', 'i8'), ('name', 'U40'), ('ra', 'f8'), ('dec', 'f8')]
+           + [(name, dtype) for name, dtype, _ in PRIMARY_COLUMNS[1:]]
+           + [(name, 'f4') for name, _ in CCD_COLUMNS]
+           + [('path', 'U200')])
+
+
+def read_headers(filename):
+    """Returns the headers of all HDUs in a FITS file, without the data."""
+    headers = []
+    with open(filename, 'rb') as fh:
+        while True:
+            blocks = []
+            while True:
+                block = fh.read(BLOCK_SIZE)
+                if len(block) < BLOCK_SIZE:
+                    return headers
+                blocks.append(block)
+                # END is the last keyword of a header, padded with spaces
+                if any(block[i:i + 80].rstrip() == b'END'
+                       for i in range(0, BLOCK_SIZE, 80)):
+                    break
+            header = fits.Header.fromstring(b''.join(blocks).decode('ascii'))
+            headers.append(header)
+            # Skip the data unit
+            naxis = header.get('NAXIS', 0)
+            size = 0
+            if naxis > 0:
+                size = np.prod([header.get('NAXIS{}'.format(i + 1), 0)
+                                for i in range(naxis)], dtype=np.int64)
+            size = (abs(header.get('BITPIX', 8)) // 8
+                    * header.get('GCOUNT', 1)
+                    * (header.get('PCOUNT', 0) + size))
+            fh.seek(int(np.ceil(size / BLOCK_SIZE)) * BLOCK_SIZE, os.SEEK_CUR)
+
+
+def harvest(run, path):
+    """Returns a dictionary with the metadata of a run, or None on failure."""
+    try:
+        headers = read_headers(path)
+    except Exception as e:
+        log.warning("{}: {}".format(path, e))
+        return None
+    if len(headers) == 0:
+        log.warning("{}: no headers".format(path))
+        return None
+    primary, ccds = headers[0], headers[1:]
+    row = {'runno': int(run), 'path': path}
+    for name, dtype, keywords in PRIMARY_COLUMNS:
+        values = [primary[kw] for kw in keywords if kw in primary]
+        if len(values) > 0:
+            row[name] = values[0]
+        else:
+            row[name] = '' if dtype.startswith('U') else np.nan
+    for name, keyword in CCD_COLUMNS:
+        values = [ccd[keyword] for ccd in ccds if keyword in ccd]
+        row[name] = np.median(values) if len(values) > 0 else np.nan
+    # CASU records the seeing in pixels
+    scale = ccds[0].get('SECPPIX', PIXEL_SCALE) if len(ccds) > 0 else PIXEL_SCALE
+    row['seeing'] = row['seeing'] * scale
+    # The pointing is taken from the WCS of the first CCD
+    row['ra'] = ccds[0].get('CRVAL1', np.nan) if len(ccds) > 0 else np.nan
+    row['dec'] = ccds[0].get('CRVAL2', np.nan) if len(ccds) > 0 else np.nan
+    return row
+
+
+def harvest_index(index, threads=THREADS):
+    """Returns a table with one row per run in the index."""
+    runs = index.runs()
+    log.info("Harvesting the headers of {} runs".format(len(runs)))
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        rows = [row for row in pool.map(lambda args: harvest(*args), runs)
+                if row is not None]
+    return Table(rows=[[row[name] for name, _ in COLUMNS] for row in rows],
+                 names=[name for name, _ in COLUMNS],
+                 dtype=[dtype for _, dtype in COLUMNS])
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Harvests the FITS headers of all runs in the image index.")
+    parser.add_argument("-o", "--output", default=OUTPUT_FN,
+                        help="output table (default: %(default)s)")
+    parser.add_argument("-t", "--threads", type=int, default=THREADS,
+                        help="number of frames read concurrently")
+    args = parser.parse_args()
+    table = harvest_index(imageindex.ImageIndex(imageindex.INDEX_FN),
+                          threads=args.threads)
+    log.info("Writing {}".format(args.output))
+    table.write(args.output, overwrite=True)
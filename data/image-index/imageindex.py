@@ -0,0 +1,197 @@
+"""Compact on-disk index of image and confidence map locations.
+
+The index is an SQLite database which holds the same information as
+`run2path.json` and `dir2conf.json`, in two tables:
+
+ * `run2path(run INTEGER PRIMARY KEY, path TEXT)`
+ * `dir2conf(dir TEXT, band TEXT, path TEXT, PRIMARY KEY (dir, band))`
+
+Unlike the JSON files, the database does not need to be parsed in full
+before the first lookup; it is opened lazily and each lookup is a B-tree
+search on disk, which keeps the start-up time of every worker short.
+"""
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+
+INDEX_FN = "imageindex.db"
+BATCH_SIZE = 500  # Number of keys per query in bulk lookups
+
+
+class ImageIndex(object):
+    """Read-only, lazily opened view of the index.
+
+    Each thread and each (forked) process opens its own connection,
+    because SQLite connections must not be shared between them.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the SQLite database.
+    """
+
+    def __init__(self, filename=INDEX_FN):
+        self.filename = filename
+        self._local = threading.local()
+
+    def _connection(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.conn = sqlite3.connect(
+                            'file:{}?mode=ro'.format(self.filename), uri=True)
+            local.pid = os.getpid()
+        return local.conn
+
+    def path(self, run):
+        """Returns the path of the image of a run; raises KeyError if unknown."""
+        row = self._connection().execute(
+                    "SELECT path FROM run2path WHERE run = ?",
+                    (int(run),)).fetchone()
+        if row is None:
+            raise KeyError(str(run))
+        return row[0]
+
+    def confmap(self, directory, band):
+        """Returns the confidence map for a directory and band; raises
+        KeyError if unknown."""
+        row = self._connection().execute(
+                    "SELECT path FROM dir2conf WHERE dir = ? AND band = ?",
+                    (directory, band)).fetchone()
+        if row is None:
+            raise KeyError("{} ({})".format(directory, band))
+        return row[0]
+
+    def runs(self):
+        """Returns a list of (run, path) tuples for all the runs."""
+        return self._connection().execute(
+                    "SELECT run, path FROM run2path ORDER BY run").fetchall()
+
+    def _bulk_lookup(self, query, keys, params=()):
+        """Returns {key: path} for the keys found by a query of the form
+        "SELECT key, path ... WHERE key IN ({})"."""
+        conn = self._connection()
+        result = {}
+        for i in range(0, len(keys), BATCH_SIZE):
+            batch = list(keys[i:i + BATCH_SIZE])
+            sql = query.format(','.join('?' * len(batch)))
+            result.update(conn.execute(sql, batch + list(params)).fetchall())
+        return result
+
+    def paths(self, runs):
+        """Returns the image paths of many runs at once.
+
+        Parameters
+        ----------
+        runs : array of int
+
+        Returns
+        -------
+        paths : array of object
+            Paths, or None for runs which are not in the index.
+        """
+        unique, inverse = np.unique(np.asarray(runs, dtype=np.int64),
+                                    return_inverse=True)
+        found = self._bulk_lookup(
+                    "SELECT run, path FROM run2path WHERE run IN ({})",
+                    [int(run) for run in unique])
+        lookup = np.array([found.get(int(run)) for run in unique],
+                          dtype=object)
+        return lookup[inverse]
+
+    def confmaps(self, directories, band):
+        """Returns the confidence maps of many directories at once.
+
+        Returns
+        -------
+        paths : array of object
+            Paths, or None for directories without a confidence map.
+        """
+        unique, inverse = np.unique(np.asarray(directories, dtype=str),
+                                    return_inverse=True)
+        found = self._bulk_lookup(
+                    "SELECT dir, path FROM dir2conf "
+                    "WHERE dir IN ({}) AND band = ?",
+                    [str(d) for d in unique], params=[band])
+        lookup = np.array([found.get(str(d)) for d in unique], dtype=object)
+        return lookup[inverse]
+
+
+def _update_table(conn, table, columns, keys, rows):
+    """Makes a table hold exactly `rows`, writing only the rows that changed.
+
+    Parameters
+    ----------
+    columns : list of str
+        Names of the columns of the table.
+
+    keys : int
+        Number of leading columns which make up the primary key.
+
+    Returns
+    -------
+    count : int
+        Number of rows inserted, replaced or deleted.
+    """
+    old = set(conn.execute("SELECT {} FROM {}".format(",".join(columns), table)))
+    new = set(rows)
+    new_keys = set(row[:keys] for row in new)
+    removed = [row[:keys] for row in old - new if row[:keys] not in new_keys]
+    changed = new - old
+    where = " AND ".join("{} = ?".format(col) for col in columns[:keys])
+    conn.executemany("DELETE FROM {} WHERE {}".format(table, where), removed)
+    conn.executemany("INSERT OR REPLACE INTO {} VALUES ({})".format(
+                        table, ",".join("?" * len(columns))), changed)
+    return len(removed) + len(changed)
+
+
+def write_run2path(run2path, filename=INDEX_FN):
+    """Updates the run2path table of the index; only the runs which were
+    added, moved or removed are written.
+
+    Parameters
+    ----------
+    run2path : dict
+        Maps run numbers (str or int) onto paths.
+
+    Returns
+    -------
+    count : int
+        Number of rows changed.
+    """
+    with sqlite3.connect(filename) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS run2path "
+                     "(run INTEGER PRIMARY KEY, path TEXT NOT NULL)")
+        count = _update_table(conn, "run2path", ["run", "path"], 1,
+                              [(int(run), path)
+                               for run, path in run2path.items()])
+    conn.close()
+    return count
+
+
+def write_dir2conf(dir2conf, filename=INDEX_FN):
+    """Updates the dir2conf table of the index; only the confidence maps
+    which were added, moved or removed are written.
+
+    Parameters
+    ----------
+    dir2conf : dict
+        Maps directories onto dictionaries which map bands onto paths.
+
+    Returns
+    -------
+    count : int
+        Number of rows changed.
+    """
+    with sqlite3.connect(filename) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS dir2conf "
+                     "(dir TEXT, band TEXT, path TEXT NOT NULL, "
+                     "PRIMARY KEY (dir, band))")
+        count = _update_table(conn, "dir2conf", ["dir", "band", "path"], 2,
+                              [(mydir, band, path)
+                               for mydir, bands in dir2conf.items()
+                               for band, path in bands.items()])
+    conn.close()
+    return count
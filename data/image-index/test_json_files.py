@@ -1,29 +1,25 @@
-"""Check to see if the JSON files contain all the info we need."""
+"""Check to see if the image index contains all the info we need."""
 import os
-import json
-import numpy as np
+import sys
 
 from astropy.table import Table
 from astropy import log
 
+from imageindex import ImageIndex
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'quicklook'))
+import preflight
 
-RUN2PATH = json.load(open("run2path.json", "r"))
-DIR2CONF = json.load(open("dir2conf.json", "r"))
 
 BANDS = ["u", "g", "r"]
 
 if __name__ == "__main__":
     qc = Table.read("/home/gb/dev/uvex-qc/data/casu-dqc/uvex-casu-dqc-by-field.fits")
-    for row in qc:
-        if np.all([row["runno_"+band] != "" for band in BANDS]):
-            for band in ["u", "g", "r"]:
-                runno = row["runno_"+band]
-
-                # Check if we have the image FITS file for the run number
-                if not runno in RUN2PATH:
-                    log.error("{}: image missing".format(runno))
-                else:
-                    # Check if we know the confidence map for this directory
-                    directory = os.path.dirname(RUN2PATH[runno])
-                    if directory not in DIR2CONF or band not in DIR2CONF[directory]:
-                        log.error("{}: {} conf map missing".format(directory, band))
+    # Only the index is checked here; the files themselves are not stat'ed
+    ready, missing = preflight.plan(qc, ImageIndex("imageindex.db"),
+                                    bands=BANDS, stat=False)
+    for row in missing:
+        if not row["reason"].startswith("no "):  # field not observed in all bands
+            log.error("{}: {}".format(row["field"], row["reason"]))
+    log.info("{} fields are ready, {} are missing".format(len(ready), len(missing)))
@@ -1,52 +1,376 @@
 #!/usr/bin/env python
-"""Downloads the INT observing logs between 2003 and today."""
-from __future__ import (absolute_import, division, print_function,
-                        unicode_literals)
+"""Downloads the INT observing logs between 2003 and today.
 
-__author__ = "Geert Barentsen"
-
-import logging
-logging.basicConfig()
-log = logging.getLogger()
-import mechanize
-import datetime
+The search form of `inglogs.php` is read once, after which the form is
+submitted directly for every night, with the action, method, hidden fields
+and submit button of the form.  Requests are made over a small number of kept-alive
+connections, with a minimum delay between the start of any two requests to
+be polite to the server, and are retried with an increasing delay when
+they fail.  Redirects are followed, as a browser would.  Nights which are already in `downloaded/` are skipped, so an
+interrupted download can simply be restarted.
+"""
+import os
+import sys
 import time
+import datetime
+import threading
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urlencode, urljoin, urlparse
+
+from astropy import log
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ratelimit import RateLimiter
 
+__author__ = "Geert Barentsen"
+
+
+URL = "http://www.ing.iac.es/astronomy/observing/inglogs.php"
 DESTINATION = 'downloaded'  # Where to store the downloaded logs?
+START_DATE = datetime.date(2003, 1, 1)
+CONNECTIONS = 4  # Number of concurrent requests
+DELAY = 1.  # Minimum number of seconds between the start of two requests
+RETRIES = 4  # Number of times a failed request is retried
+BACKOFF = 5.  # Seconds to wait before the first retry; doubles every retry
+TIMEOUT = 60  # Seconds
+MAX_REDIRECTS = 5  # Number of redirects followed per request
+REDIRECTS = (301, 302, 303, 307, 308)
+# The search form is the second form on the page, and is submitted using
+# its second submit button, as `mechanize` used to do
+FORM_INDEX = 1
+SUBMIT_INDEX = 1
+
+
+class FormParser(HTMLParser):
+    """Collects the forms in an HTML page, with the default values of
+    their fields and their submit buttons."""
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.forms = []
+        self._select = None  # [name, value of the selected or first option]
+        self._option = None  # [value, text, selected] of the current option
+
+    def _end_option(self):
+        if self._option is not None and self._select is not None:
+            value, text, selected = self._option
+            value = text.strip() if value is None else value
+            if selected or self._select[1] is None:
+                self._select[1] = value
+        self._option = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'form':
+            self.forms.append({'action': attrs.get('action') or '',
+                               'method': (attrs.get('method') or 'get').upper(),
+                               'fields': [], 'submits': []})
+            return
+        if len(self.forms) == 0:
+            return
+        form, name = self.forms[-1], attrs.get('name')
+        if tag == 'input':
+            kind = (attrs.get('type') or 'text').lower()
+            if kind in ('submit', 'image'):
+                form['submits'].append((kind, name, attrs.get('value') or ''))
+            elif kind in ('checkbox', 'radio'):
+                if name and 'checked' in attrs:
+                    form['fields'].append((name, attrs.get('value') or 'on'))
+            elif name and kind not in ('reset', 'button', 'file'):
+                form['fields'].append((name, attrs.get('value') or ''))
+        elif tag == 'button':
+            if (attrs.get('type') or 'submit').lower() == 'submit':
+                form['submits'].append(('submit', name, attrs.get('value') or ''))
+        elif tag == 'select':
+            self._select = [name, None]
+        elif tag == 'option':
+            self._end_option()
+            self._option = [attrs.get('value'), '', 'selected' in attrs]
+
+    def handle_data(self, data):
+        if self._option is not None:
+            self._option[1] += data
+
+    def handle_endtag(self, tag):
+        if tag == 'option':
+            self._end_option()
+        elif tag == 'select' and self._select is not None:
+            self._end_option()
+            if self._select[0] and self._select[1] is not None:
+                self.forms[-1]['fields'].append(tuple(self._select))
+            self._select = None
+
+
+class LogDownloader(object):
+    """
+    Downloads the nightly INT logs from the ING log search form.
+
+    Parameters
+    ----------
+    url : str
+        Address of `inglogs.php`, or of a stand-in server for testing.
+
+    destination : str
+        Directory in which to store the logs.
+
+    connections : int
+        Number of concurrent requests.
+
+    delay : float
+        Minimum number of seconds between the start of two requests.
+
+    retries : int
+        Number of times a failed request is retried.
+
+    backoff : float
+        Seconds to wait before the first retry; doubles every retry.
+    """
+
+    def __init__(self, url=URL, destination=DESTINATION,
+                 connections=CONNECTIONS, delay=DELAY,
+                 retries=RETRIES, backoff=BACKOFF):
+        self.url = url
+        self.destination = destination
+        self.connections = connections
+        self.limiter = RateLimiter(delay)
+        self.retries = retries
+        self.backoff = backoff
+        self._local = threading.local()  # Holds the connections of a thread
+        self._form_lock = threading.Lock()
+        self.form = None
+
+    def _connection(self, server):
+        """Returns the kept-alive connection of the calling thread to the
+        scheme and host of a parsed URL."""
+        if not hasattr(self._local, 'conns'):
+            self._local.conns = {}
+        key = (server.scheme, server.netloc)
+        if key not in self._local.conns:
+            if server.scheme == 'https':
+                conn = HTTPSConnection(server.netloc, timeout=TIMEOUT)
+            else:
+                conn = HTTPConnection(server.netloc, timeout=TIMEOUT)
+            self._local.conns[key] = conn
+        return self._local.conns[key]
+
+    def _reset_connection(self, server):
+        conn = getattr(self._local, 'conns', {}).pop(
+                    (server.scheme, server.netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def filename(self, date):
+        """Returns where the log of a given night is stored."""
+        return os.path.join(self.destination, "intlog_{0:04d}{1:02d}{2:02d}.txt"
+                            .format(date.year, date.month, date.day))
+
+    def _send(self, method, url, body=None, headers={}, what=''):
+        """Sends a request, retrying on failure.
+
+        Returns
+        -------
+        response, content : `http.client.HTTPResponse`, bytes
+            The final response, which is either a success or a redirect.
+        """
+        server = urlparse(url)
+        path = server.path or '/'
+        if server.query:
+            path += '?' + server.query
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                wait = self.backoff * 2 ** (attempt - 1)
+                log.warning("Retrying {0} in {1:.0f}s".format(what, wait))
+                time.sleep(wait)
+            self.limiter.wait()
+            try:
+                conn = self._connection(server)
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                content = response.read()
+            except (HTTPException, OSError) as e:
+                log.warning("{0}: {1}".format(what, e))
+                self._reset_connection(server)
+                continue
+            if response.status == 200 or response.status in REDIRECTS:
+                return response, content
+            log.warning("{0}: HTTP {1} {2}".format(what, response.status,
+                                                   response.reason))
+            if response.status < 500:
+                break  # Retrying will not help
+        raise IOError("Failed to fetch {0}".format(what))
+
+    def _request(self, method, url, body=None, headers={}, what=''):
+        """Sends a request, following redirects and retrying on failure.
+
+        Returns
+        -------
+        content, url : bytes, str
+            The content, and the URL it came from after any redirects.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            response, content = self._send(method, url, body, headers, what)
+            if response.status == 200:
+                return content, url
+            location = response.getheader('Location')
+            if not location:
+                raise IOError("{0}: HTTP {1} without a Location".format(
+                              what, response.status))
+            url = urljoin(url, location)
+            log.debug("{0}: redirected to {1}".format(what, url))
+            # Like browsers, turn a POST into a GET unless asked to repeat it
+            if response.status == 303 or (response.status in (301, 302)
+                                          and method == 'POST'):
+                method, body, headers = 'GET', None, {}
+        raise IOError("{0}: more than {1} redirects".format(what,
+                                                            MAX_REDIRECTS))
+
+    def load_form(self):
+        """Reads the search form from the page, unless it was read before.
+
+        Returns
+        -------
+        form : dict
+            The 'action' URL, the 'method', the default 'fields' and the
+            'submit' fields of the form, as used by `fetch_log`.
+        """
+        with self._form_lock:
+            if self.form is not None:
+                return self.form
+            content, page_url = self._request('GET', self.url, what=self.url)
+            parser = FormParser()
+            parser.feed(content.decode('latin-1'))
+            if len(parser.forms) <= FORM_INDEX:
+                raise IOError("{0}: the search form is missing".format(self.url))
+            form = parser.forms[FORM_INDEX]
+            submits = form['submits']
+            if len(submits) <= SUBMIT_INDEX:
+                raise IOError("{0}: the submit button is missing".format(self.url))
+            kind, name, value = submits[SUBMIT_INDEX]
+            submit = []
+            if name and kind == 'image':
+                submit = [(name + '.x', '1'), (name + '.y', '1')]
+            elif name:
+                submit = [(name, value)]
+            # The action is relative to the page, wherever it was redirected
+            action = urljoin(page_url, form['action'])
+            self.form = {'action': action, 'method': form['method'],
+                         'fields': form['fields'], 'submit': submit}
+            log.info("Using the form at {0} ({1} {2})".format(
+                     self.url, form['method'], action))
+            return self.form
+
+    def fetch_log(self, date):
+        """Returns the log for a given date as bytes."""
+        form = self.load_form()
+        values = {"form[tel]": "int",
+                  "form[day]": "%02i" % date.day,
+                  "form[month]": "%02i" % date.month,
+                  "form[year]": "%s" % date.year}
+        # Fill in the form, keeping the other fields at their defaults
+        fields, filled = [], set()
+        for name, value in form['fields']:
+            if name in values:
+                if name in filled:
+                    continue
+                value = values[name]
+                filled.add(name)
+            fields.append((name, value))
+        missing = sorted(set(values) - filled)
+        if missing:
+            raise IOError("The search form has no {0} field".format(
+                          ", ".join(missing)))
+        data = urlencode(fields + form['submit'])
+        if form['method'] == 'POST':
+            headers = {"Content-Type": "application/x-www-form-urlencoded"}
+            content, _ = self._request('POST', form['action'], data, headers,
+                                       what=date)
+        else:
+            action = urlparse(form['action'])
+            content, _ = self._request('GET',
+                                       action._replace(query=data).geturl(),
+                                       what=date)
+        return content
+
+    def download_log(self, date):
+        """Writes the log for a given date to disk, unless it exists.
+
+        Returns
+        -------
+        downloaded : bool
+            False if the log was already on disk.
+        """
+        filename = self.filename(date)
+        if os.path.exists(filename):
+            return False
+        log.info('Fetching the log for {0}'.format(date))
+        content = self.fetch_log(date)
+        # Write to a temporary file first, such that an interrupted download
+        # never leaves a truncated log which would be skipped next time
+        tmpfile = filename + '.tmp'
+        with open(tmpfile, 'wb') as fh:
+            fh.write(content)
+        os.rename(tmpfile, filename)
+        return True
+
+    def _download_log(self, date):
+        try:
+            return self.download_log(date)
+        except IOError as e:
+            log.error(str(e))
+            return None
+
+    def download_all(self, start_date=START_DATE, end_date=None):
+        """Downloads all missing logs from `start_date` up to, but not
+        including, `end_date` (default: today).
+
+        Returns
+        -------
+        failed : list of `datetime.date`
+            Nights which could not be downloaded.
+        """
+        if end_date is None:
+            end_date = datetime.date.today()
+        dates = [start_date + datetime.timedelta(days=i)
+                 for i in range((end_date - start_date).days)]
+        missing = [date for date in dates
+                   if not os.path.exists(self.filename(date))]
+        log.info("{0} of {1} nights are already downloaded".format(
+                 len(dates) - len(missing), len(dates)))
+        try:
+            os.makedirs(self.destination)
+        except OSError:
+            pass  # dir exists
+        if missing:
+            self.load_form()
+        with ThreadPoolExecutor(max_workers=self.connections) as pool:
+            results = list(pool.map(self._download_log, missing))
+        return [date for date, result in zip(missing, results) if result is None]
 
 
-def fetch_log(date):
-    """Returns the log for a given date as a string."""
-    log.info('Fetching the log for {0}'.format(date))
-    br = mechanize.Browser()
-    br.open("http://www.ing.iac.es/astronomy/observing/inglogs.php")
-    br.select_form(nr=1)
-    br["form[tel]"] = ["int"]
-    br["form[day]"] = ["%02i" % date.day]
-    br["form[month]"] = ["%02i" % date.month]
-    br["form[year]"] = ["%s" % date.year]
-    response = br.submit(nr=1)
-    return response.get_data()
-
-def download_log(date):
-    """Writes the log for a given date to disk.""" 
-    f = open("{0}/intlog_{1:04d}{2:02d}{3:02d}.txt".format(
-             DESTINATION, date.year, date.month, date.day),
-             'w')
-    f.write(fetch_log(date))
-    f.close()
-
-def download_all(start_date=datetime.datetime(2003, 1, 1)):
-    """Downloads all logs from a given starting date."""
-    date = start_date
-    today = datetime.datetime.now()
-    while date < today:
-        download_log(date)
-        date += datetime.timedelta(days=1)
-        time.sleep(1)  # Let's be nice  
+def parse_date(text):
+    return datetime.datetime.strptime(text, "%Y-%m-%d").date()
 
 
 if __name__ == '__main__':
-    log.setLevel(logging.INFO)
-    download_all(start_date=datetime.datetime(2013, 7, 14))
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Downloads the INT observing logs which are not yet on disk.")
+    parser.add_argument("--start", type=parse_date, default=START_DATE,
+                        help="first night, as YYYY-MM-DD (default: %(default)s)")
+    parser.add_argument("--end", type=parse_date, default=None,
+                        help="night after the last night (default: today)")
+    parser.add_argument("--url", default=URL,
+                        help="address of the log search form (default: %(default)s)")
+    parser.add_argument("--destination", default=DESTINATION,
+                        help="local directory (default: %(default)s)")
+    parser.add_argument("-c", "--connections", type=int, default=CONNECTIONS,
+                        help="number of concurrent requests (default: %(default)s)")
+    parser.add_argument("--delay", type=float, default=DELAY,
+                        help="minimum seconds between two requests (default: %(default)s)")
+    args = parser.parse_args()
+    downloader = LogDownloader(url=args.url, destination=args.destination,
+                               connections=args.connections, delay=args.delay)
+    failed = downloader.download_all(start_date=args.start, end_date=args.end)
+    for date in failed:
+        log.error("Missing: {0}".format(date))
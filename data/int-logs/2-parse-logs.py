@@ -4,8 +4,12 @@
 Output
 ------
 This script will create two files:
-* logs_bynight.csv : observing conditions, one row per night.
-* logs_byrun.csv : pointing details, one row per telescope exposure.
+* intlogs-by-night.csv : observing conditions, one row per night.
+* intlogs-by-run.csv : pointing details, one row per telescope exposure.
+
+The logs are parsed in parallel, see `intlog.py`.  The parsed logs are
+cached in `intlogs-cache.db`, such that only new or modified logs are
+parsed again on the next run.
 
 Caveats
 -------
@@ -19,94 +23,31 @@ are sometimes wrong by an unknown amount. (Which makes life fun.)
 
 __author__ = "Geert Barentsen"
 
-import re
-import numpy as np
-import os
-
-
-if __name__ == '__main__':
-
-    csv_bynight = open("intlogs-by-night.csv", "w")
-    csv_byrun = open("intlogs-by-run.csv", "w")
-
-    # CSV headers
-    csv_bynight.write("night,observer,temp_avg,hum_avg,lost_weather,lost_technical,lost_other,comments_weather,comments_night\n")
-    csv_byrun.write("run,name,ra_hms,dec_dms,exptime,night,observer,temp_avg,hum_avg,lost_weather,lost_technical,lost_other,comments_weather,comments_night,comments_exposure\n")
-
-
-    for filename in sorted(os.listdir("downloaded")):
-        if not (re.match("intlog_\d+.txt", filename) or re.match("run_log_\d+.int", filename)):
-            continue
-
-        f = open("downloaded/"+filename, "r")
-        log = f.readlines()
-
-        temp, hum = [], []
-
-        # Assume headers take no more than 70 lines
-        for i, line in enumerate(log[0:70]):
-            m = re.match("^DATE\s*(\d+)", line, re.M|re.S)
-            if m: night = m.group(1)
-
-            m = re.match("^OBSERVER/S\s*(.*)\s+$", line, re.M|re.S)
-            if m: observer = m.group(1).replace('"', '""')
-
-            m = re.match("^\d{2}:00\s+([0-9.]+)\s+([0-9.]+)", line, re.M|re.S)
-            if m: 
-                temp.append( m.group(1) )
-                hum.append( m.group(2) )
+from astropy import log
 
-            m = re.match("^TIME LOST weather\s+(\d+:\d+)", line, re.M|re.S)
-            if m: lost_weather = m.group(1)
+import intlog
 
-            m = re.match("^TIME LOST Technical\s+(\d+:\d+)", line, re.M|re.S)
-            if m: lost_technical = m.group(1)
 
-            m = re.match("^TIME LOST Other\s+(\d+:\d+)", line, re.M|re.S)
-            if m: lost_other = m.group(1)
+LOG_DIR = "downloaded"
+BYNIGHT_FN = "intlogs-by-night.csv"
+BYRUN_FN = "intlogs-by-run.csv"
+CACHE_FN = "intlogs-cache.db"
 
-            m = re.match("^WEATHER CONDITIONS(.*)", line, re.M|re.S)
-            if m: weather = log[i+1].strip().replace('"', '""')
 
-            m = re.match("^COMMENTS(.*)", line, re.M|re.S)
-            if m: night_comments = log[i+1].strip().replace('"', '""')
-
-
-
-        out = "%s,\"%s\",%.1f,%.1f,%s,%s,%s,\"%s\",\"%s\"\n" % \
-                (night, observer, \
-                np.mean(np.array(temp, dtype="float")), \
-                np.mean(np.array(hum, dtype="float")), \
-                lost_weather, lost_technical, lost_other,
-                weather, night_comments)
-        csv_bynight.write(out)
-
-
-        # Data
-        for line in log[20:]:
-
-            m = re.match("^\s*(\d\d\d\d\d+).*WFC", line, re.M|re.S)
-            if m:
-                run = m.group(1).strip()
-                name = line[8:25].strip().lower()
-                ra = line[25:36].strip()
-                dec = line[37:48].strip()
-                exptime = line[75:82].strip()
-                comments = line[121:].strip().replace('"', '""')
-
-
-                out = "%s,\"%s\",%s,%s,%s,%s,\"%s\",%.1f,%.1f,%s,%s,%s,\"%s\",\"%s\",\"%s\"\n" % \
-                        (run, name, ra, dec, exptime, \
-                        night, observer, \
-                        np.mean(np.array(temp, dtype="float")), \
-                        np.mean(np.array(hum, dtype="float")), \
-                        lost_weather, lost_technical, lost_other,
-                        weather, night_comments, comments)
-                csv_byrun.write(out)
-
-        csv_bynight.flush()
-        csv_byrun.flush()
-
-
-    csv_bynight.close()
-    csv_byrun.close()
\ No newline at end of file
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Parses the INT observing logs into CSV tables.")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="parse all logs, ignoring %s" % CACHE_FN)
+    args = parser.parse_args()
+
+    filenames = intlog.find_logs(LOG_DIR)
+    log.info("Found {} logs".format(len(filenames)))
+    cache = None if args.no_cache else intlog.ParseCache(CACHE_FN)
+    bynight, byrun = intlog.parse_logs(filenames, processes=args.processes,
+                                       cache=cache)
+    for table, filename in ((bynight, BYNIGHT_FN), (byrun, BYRUN_FN)):
+        log.info("Writing {} rows to {}".format(len(table), filename))
+        table.write(filename, format='ascii.csv', overwrite=True)
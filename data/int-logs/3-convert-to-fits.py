@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Derives positions, filters and field names of the runs in the INT logs.
+
+This script produces the following tables from `intlogs-by-run.csv`:
+* int-logs-by-run.fits.gz : all runs, with ra, dec, l, b, filter and field.
+* uvex-logs-by-run.fits.gz, iphas-logs-by-run.fits.gz and
+  kepler-logs-by-run.fits.gz : the runs of each survey.
+* uvex-unreduced-runs.fits.gz : UVEX runs which are not in the CASU DQC table.
+
+The input is read once: every run is assigned to a survey by the prefix of
+its name in a single pass, and the unreduced runs are found with an
+anti-join on the integer run number.  The outputs are compressed and written
+concurrently.
+"""
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from astropy import log
+from astropy.io import fits
+from astropy.table import Table
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import derive
+
+
+INPUT_FN = "intlogs-by-run.csv"
+CASU_FN = "../casu-dqc/uvex-casu-dqc-by-run.fits"
+# Maps the prefix of the names of the runs onto the output files
+SURVEYS = {"uvex": "uvex-logs-by-run.fits.gz",
+           "intphas": "iphas-logs-by-run.fits.gz",
+           "kepler": "kepler-logs-by-run.fits.gz"}
+UNREDUCED_FN = "uvex-unreduced-runs.fits.gz"
+
+
+def convert(t):
+    """Adds the derived columns to the by-run table of the logs."""
+    ra = derive.hms_to_degrees(t['ra_hms'])
+    dec = derive.dms_to_degrees(t['dec_dms'])
+    t.add_column(ra, name='ra', index=t.colnames.index('ra_hms'))
+    t.add_column(dec, name='dec', index=t.colnames.index('ra_hms'))
+    t['l'], t['b'] = derive.galactic(ra, dec)
+    t['filter'] = derive.filter_names(t['name'])
+    t['field'] = derive.field_names(t['name'])
+    return t
+
+
+def split(t):
+    """Returns {output file: table} of the runs of each survey, and the
+    UVEX runs which have not been reduced by CASU."""
+    prefixes = derive.prefixes(t['name'])
+    # Sort once by survey, such that every survey is a contiguous slice
+    order = np.argsort(prefixes, kind='stable')
+    prefixes = prefixes[order]
+    outputs = {}
+    for prefix, filename in SURVEYS.items():
+        start = np.searchsorted(prefixes, prefix, side='left')
+        end = np.searchsorted(prefixes, prefix, side='right')
+        outputs[filename] = t[order[start:end]]
+    # Only the run numbers of the CASU table are needed
+    with fits.open(CASU_FN, memmap=True) as hdulist:
+        reduced = np.array(hdulist[1].data['runno'])
+    uvex = outputs[SURVEYS["uvex"]]
+    outputs[UNREDUCED_FN] = uvex[derive.anti_join(uvex['run'], reduced)]
+    return outputs
+
+
+def write(t, filename):
+    log.info("Writing {} runs to {}".format(len(t), filename))
+    t.write(filename, overwrite=True)
+
+
+if __name__ == '__main__':
+    t = convert(Table.read(INPUT_FN, format='ascii.csv'))
+    outputs = split(t)
+    outputs["int-logs-by-run.fits.gz"] = t
+    # Compression dominates the time spent writing; zlib releases the GIL
+    with ThreadPoolExecutor(max_workers=len(outputs)) as pool:
+        for future in [pool.submit(write, table, filename)
+                       for filename, table in sorted(outputs.items())]:
+            future.result()
@@ -6,10 +6,15 @@ This script produces `unreduced-uvex-fields-which-may-be-good.txt`.
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import os
+import sys
 import logging
 import numpy as np
 from astropy.table import Table
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import tablecache
+
 # Nights with no hope of useful data, judging by the logs:
 HORRENDOUS_NIGHTS = [20060722, 20101103, 20110729, 20111124, 20111125]
 
@@ -29,7 +34,7 @@ if __name__ == '__main__':
             output.write(field+'\n')
 
     # By-product: list of fields attempted
-    t = Table.read('uvex-logs-by-run.fits.gz')
+    t = tablecache.read('uvex-logs-by-run.fits.gz', columns=['field'])
     with open('uvex-fields-attempted.txt', 'w') as output:
         for field in np.sort(np.unique(t['field'])):
             output.write(field+'\n')
@@ -0,0 +1,272 @@
+"""Parses the nightly INT observing logs into by-night and by-run tables.
+
+Every log starts with a header describing the night (date, observers,
+hourly temperature and humidity, time lost, comments), followed by one
+line per exposure.  The header fields are recognised by a single
+precompiled pattern, and the nightly statistics are computed once per log
+rather than once per exposure.  Logs are parsed in parallel by a pool of
+processes, each returning typed columns which are concatenated into the
+output tables.
+
+The result of every log can be kept in a `ParseCache`, such that only new
+or modified logs are parsed again.
+"""
+import os
+import re
+import zlib
+import pickle
+import sqlite3
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from astropy import log
+from astropy.table import Table
+
+
+VERSION = 1  # Increment whenever a change alters the output of `parse_log`
+# Names of the downloaded logs
+FILENAME_PATTERN = re.compile(r'^(intlog_\d+\.txt|run_log_\d+\.int)$')
+HEADER_LINES = 70  # Assume headers take no more than 70 lines
+DATA_START = 20  # Exposures are never listed in the first 20 lines
+# One alternative per header field; the last matching line wins
+HEADER_PATTERN = re.compile(
+    r'^(?:DATE\s*(?P<night>\d+)'
+    r'|OBSERVER/S\s*(?P<observer>.*\S)'
+    r'|\d{2}:00\s+(?P<temp>[0-9.]+)\s+(?P<hum>[0-9.]+)'
+    r'|TIME LOST weather\s+(?P<lost_weather>\d+:\d+)'
+    r'|TIME LOST Technical\s+(?P<lost_technical>\d+:\d+)'
+    r'|TIME LOST Other\s+(?P<lost_other>\d+:\d+)'
+    r'|(?P<comments_weather>WEATHER CONDITIONS)'
+    r'|(?P<comments_night>COMMENTS))')
+RUN_PATTERN = re.compile(r'^\s*(\d{5,}).*WFC')
+
+# (name, dtype) of the columns describing a night
+NIGHT_COLUMNS = [('night', 'i8'),
+                 ('observer', str),
+                 ('temp_avg', 'f8'),
+                 ('hum_avg', 'f8'),
+                 ('lost_weather', str),
+                 ('lost_technical', str),
+                 ('lost_other', str),
+                 ('comments_weather', str),
+                 ('comments_night', str)]
+# (name, dtype, first character, last character + 1) of the exposure lines
+RUN_COLUMNS = [('run', 'i8', None, None),
+               ('name', str, 8, 25),
+               ('ra_hms', str, 25, 36),
+               ('dec_dms', str, 37, 48),
+               ('exptime', 'f8', 75, 82),
+               ('comments_exposure', str, 121, None)]
+
+
+def find_logs(directory):
+    """Returns the paths of the logs in a directory, sorted by name."""
+    return [os.path.join(directory, fn) for fn in sorted(os.listdir(directory))
+            if FILENAME_PATTERN.match(fn)]
+
+
+def _to_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+def _mean(values):
+    return float(np.mean(values)) if len(values) > 0 else np.nan
+
+
+def parse_log(filename):
+    """Parses one observing log.
+
+    Returns
+    -------
+    night : dict
+        The values of `NIGHT_COLUMNS`.
+
+    runs : dict of list
+        The values of `RUN_COLUMNS` for every WFC exposure.
+    """
+    with open(filename, encoding='latin-1') as fh:
+        lines = fh.read().splitlines()
+
+    night = {'night': 0, 'observer': '', 'lost_weather': '',
+             'lost_technical': '', 'lost_other': '',
+             'comments_weather': '', 'comments_night': ''}
+    temp, hum = [], []
+    for i, line in enumerate(lines[:HEADER_LINES]):
+        m = HEADER_PATTERN.match(line)
+        if m is None:
+            continue
+        key = m.lastgroup
+        if key == 'hum':
+            temp.append(float(m.group('temp')))
+            hum.append(float(m.group('hum')))
+        elif key in ('comments_weather', 'comments_night'):
+            # The comments are on the line below their heading
+            night[key] = lines[i + 1].strip() if i + 1 < len(lines) else ''
+        elif key == 'night':
+            night[key] = int(m.group(key))
+        else:
+            night[key] = m.group(key)
+    if night['night'] == 0:
+        log.warning("{}: no DATE found".format(filename))
+    night['temp_avg'] = _mean(temp)
+    night['hum_avg'] = _mean(hum)
+
+    runs = dict((name, []) for name, _, _, _ in RUN_COLUMNS)
+    for line in lines[DATA_START:]:
+        if 'WFC' not in line:
+            continue
+        m = RUN_PATTERN.match(line)
+        if m is None:
+            continue
+        runs['run'].append(int(m.group(1)))
+        for name, dtype, start, end in RUN_COLUMNS[1:]:
+            value = line[start:end].strip()
+            runs[name].append(_to_float(value) if dtype == 'f8' else value)
+    runs['name'] = [name.lower() for name in runs['name']]
+    return night, runs
+
+
+class ParseCache(object):
+    """
+    Keeps the results of `parse_log` in an SQLite database.
+
+    A result is valid as long as the size and modification time of its log
+    are unchanged.  If they did change, the content hash decides, so that
+    logs which were downloaded again with the same content are not parsed
+    again.  Results made by a different `VERSION` of the parser are never
+    used.  Results are stored as compressed pickles.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the SQLite database.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with sqlite3.connect(self.filename) as conn:
+            columns = [row[1] for row in
+                       conn.execute("PRAGMA table_info(logs)")]
+            if columns and 'version' not in columns:
+                conn.execute("DROP TABLE logs")  # Made before versioning
+            conn.execute("CREATE TABLE IF NOT EXISTS logs "
+                         "(path TEXT PRIMARY KEY, size INTEGER, "
+                         "mtime INTEGER, hash TEXT, version INTEGER, "
+                         "result BLOB)")
+        conn.close()
+
+    def _read(self):
+        """Returns {path: (size, mtime, hash, result blob)} for the results
+        of the current parser `VERSION`."""
+        with sqlite3.connect(self.filename) as conn:
+            rows = conn.execute("SELECT path, size, mtime, hash, result "
+                                "FROM logs WHERE version = ?",
+                                (VERSION,)).fetchall()
+        conn.close()
+        return dict((row[0], row[1:]) for row in rows)
+
+    def parse(self, filenames, processes=None):
+        """Returns the results of `parse_log` for the given logs, only
+        parsing those which are not in the cache.
+
+        Entries of logs which are not in `filenames` are removed.
+        """
+        cached = self._read()
+        results, updates, todo = {}, [], []
+        for fn in filenames:
+            st = os.stat(fn)
+            size, mtime = st.st_size, st.st_mtime_ns
+            entry = cached.get(fn)
+            if entry is not None and entry[:2] == (size, mtime):
+                results[fn] = entry[3]
+                continue
+            digest = file_hash(fn)
+            if entry is not None and entry[2] == digest:
+                results[fn] = entry[3]
+                updates.append((fn, size, mtime, digest, VERSION, entry[3]))
+            else:
+                todo.append((fn, size, mtime, digest))
+        log.info("Parsing {} of {} logs".format(len(todo), len(filenames)))
+
+        parsed = _map(parse_log, [fn for fn, _, _, _ in todo], processes)
+        for (fn, size, mtime, digest), result in zip(todo, parsed):
+            blob = zlib.compress(pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+            results[fn] = blob
+            updates.append((fn, size, mtime, digest, VERSION, blob))
+
+        with sqlite3.connect(self.filename) as conn:
+            conn.executemany("INSERT OR REPLACE INTO logs "
+                             "VALUES (?, ?, ?, ?, ?, ?)", updates)
+            conn.execute("DELETE FROM logs WHERE version != ?", (VERSION,))
+            conn.executemany("DELETE FROM logs WHERE path = ?",
+                             [(fn,) for fn in set(cached) - set(filenames)])
+        conn.close()
+        return [pickle.loads(zlib.decompress(results[fn])) for fn in filenames]
+
+
+def file_hash(filename):
+    """Returns the SHA-1 hex digest of a file's contents."""
+    with open(filename, 'rb') as fh:
+        return hashlib.sha1(fh.read()).hexdigest()
+
+
+def _map(func, filenames, processes=None):
+    """Applies `func` to the filenames on a process pool, preserving order."""
+    if processes == 1 or len(filenames) < 2:
+        return [func(fn) for fn in filenames]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(func, filenames, chunksize=32))
+
+
+def parse_logs(filenames, processes=None, cache=None):
+    """Parses many observing logs in parallel.
+
+    Parameters
+    ----------
+    filenames : list of str
+
+    processes : int
+        Number of worker processes; defaults to the number of CPUs.
+
+    cache : `ParseCache`, optional
+        Cache of previous results, to parse new or modified logs only.
+
+    Returns
+    -------
+    bynight, byrun : `~astropy.table.Table`
+        One row per log and one row per WFC exposure.  The by-run table
+        repeats the columns of the night on which the exposure was taken.
+    """
+    if cache is None:
+        results = _map(parse_log, filenames, processes)
+    else:
+        results = cache.parse(filenames, processes)
+    return make_tables(results)
+
+
+def make_tables(results):
+    """Turns the output of `parse_log` for many logs into the by-night and
+    by-run tables."""
+    bynight = Table()
+    for name, dtype in NIGHT_COLUMNS:
+        bynight[name] = np.array([night[name] for night, _ in results],
+                                 dtype=dtype)
+    byrun = Table()
+    for name, dtype, _, _ in RUN_COLUMNS[:-1]:
+        byrun[name] = np.array([value for _, runs in results
+                                for value in runs[name]], dtype=dtype)
+    # Every exposure inherits the columns of its night
+    counts = [len(runs['run']) for _, runs in results]
+    idx = np.repeat(np.arange(len(results)), counts)
+    for name, _ in NIGHT_COLUMNS:
+        byrun[name] = bynight[name][idx]
+    byrun['comments_exposure'] = np.array([value for _, runs in results
+                                           for value in runs['comments_exposure']],
+                                          dtype=str)
+    for table in (bynight, byrun):
+        table['temp_avg'].format = table['hum_avg'].format = '.1f'
+    return bynight, byrun
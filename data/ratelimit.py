@@ -0,0 +1,27 @@
+"""Spaces out the requests which several threads send to the same server."""
+import time
+import threading
+
+
+class RateLimiter(object):
+    """
+    Enforces a minimum delay between the start of any two requests.
+
+    Parameters
+    ----------
+    delay : float
+        Minimum number of seconds between the start of two requests.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._next_request = 0.
+
+    def wait(self):
+        """Blocks until the delay since the previous request has passed."""
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next_request)
+            self._next_request = start + self.delay
+        time.sleep(start - now)
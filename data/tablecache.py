@@ -0,0 +1,148 @@
+"""Memory-mappable, uncompressed columnar copies of the FITS tables.
+
+Reading a `.fits.gz` table decompresses the whole file and allocates all of
+its columns, even if only a few of them are used.  `read` instead keeps a
+sidecar directory next to the table, `<filename>.cols/`, holding every
+column as an uncompressed `.npy` file, and memory-maps only the columns
+which are asked for::
+
+    t = tablecache.read('uvex-logs-by-run.fits.gz',
+                        columns=['run', 'field', 'night'])
+
+The sidecar records the size and modification time of the table it was made
+from, and is rebuilt automatically when the table changes.
+"""
+import os
+import json
+import shutil
+
+import numpy as np
+from astropy import log
+from astropy import units as u
+from astropy.table import Table, Column, MaskedColumn
+
+
+SUFFIX = '.cols'
+META_FN = 'meta.json'
+
+
+def sidecar_path(filename):
+    """Returns the directory in which the columns of a table are kept."""
+    return filename + SUFFIX
+
+
+def fingerprint(filename):
+    """Returns a list which changes when a file is modified."""
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _read_meta(sidecar):
+    try:
+        with open(os.path.join(sidecar, META_FN)) as fh:
+            return json.load(fh)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def build(filename):
+    """(Re)creates the sidecar of a table and returns its metadata."""
+    log.info("Caching the columns of {}".format(filename))
+    source = fingerprint(filename)
+    table = Table.read(filename)
+    sidecar = sidecar_path(filename)
+    # Write to a temporary directory first, such that a reader never sees
+    # a partially written sidecar
+    tmpdir = '{}.tmp{}'.format(sidecar, os.getpid())
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    os.makedirs(tmpdir)
+    columns = []
+    for i, name in enumerate(table.colnames):
+        col = table[name]
+        data = np.asarray(col)
+        if data.dtype.byteorder == '>':  # FITS is big-endian
+            data = data.astype(data.dtype.newbyteorder('='))
+        entry = {'name': name,
+                 'file': '{:03d}.npy'.format(i),
+                 'unit': None if col.unit is None else str(col.unit),
+                 'description': col.description,
+                 'format': col.format,
+                 'mask': None}
+        np.save(os.path.join(tmpdir, entry['file']), data)
+        if isinstance(col, MaskedColumn) and np.any(col.mask):
+            entry['mask'] = '{:03d}.mask.npy'.format(i)
+            np.save(os.path.join(tmpdir, entry['mask']), np.asarray(col.mask))
+        columns.append(entry)
+    meta = {'source': source, 'columns': columns}
+    with open(os.path.join(tmpdir, META_FN), 'w') as fh:
+        json.dump(meta, fh, indent=1)
+
+    shutil.rmtree(sidecar, ignore_errors=True)
+    try:
+        os.rename(tmpdir, sidecar)
+    except OSError:
+        # Another process got there first
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return meta
+
+
+def read(filename, columns=None, memmap=True):
+    """Reads (some of) the columns of a FITS table through its sidecar.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the FITS table, e.g. 'uvex-logs-by-run.fits.gz'.
+
+    columns : list of str, optional
+        Names of the columns to read; all columns by default.
+
+    memmap : bool
+        If True, the columns are read-only memory maps which are only paged
+        in from disk when they are used.  If False, they are read into
+        ordinary arrays.
+
+    Returns
+    -------
+    table : `~astropy.table.Table`
+    """
+    sidecar = sidecar_path(filename)
+    meta = _read_meta(sidecar)
+    if meta is None or meta['source'] != fingerprint(filename):
+        meta = build(filename)
+    entries = dict((entry['name'], entry) for entry in meta['columns'])
+    if columns is None:
+        columns = [entry['name'] for entry in meta['columns']]
+    missing = [name for name in columns if name not in entries]
+    if missing:
+        raise KeyError("{}: no such columns: {}".format(filename,
+                                                        ', '.join(missing)))
+
+    mmap_mode = 'r' if memmap else None
+    table = Table()
+    for name in columns:
+        entry = entries[name]
+        data = np.load(os.path.join(sidecar, entry['file']), mmap_mode=mmap_mode)
+        unit = None
+        if entry['unit'] is not None:
+            unit = u.Unit(entry['unit'], parse_strict='silent')
+        kwargs = {'name': name, 'unit': unit, 'copy': False,
+                  'description': entry['description'], 'format': entry['format']}
+        if entry['mask'] is None:
+            table.add_column(Column(data, **kwargs), copy=False)
+        else:
+            mask = np.load(os.path.join(sidecar, entry['mask']))
+            table.add_column(MaskedColumn(data, mask=mask, **kwargs),
+                             copy=False)
+    return table
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Creates or refreshes the columnar sidecars of FITS tables.")
+    parser.add_argument("filenames", nargs="+", help="FITS tables")
+    args = parser.parse_args()
+    for filename in args.filenames:
+        meta = _read_meta(sidecar_path(filename))
+        if meta is None or meta['source'] != fingerprint(filename):
+            build(filename)
@@ -0,0 +1,121 @@
+"""
+Content-addressed cache of intermediate quicklook products.
+
+Products such as mosaicked or downsampled band images are stored under a
+key which is a hash of the input files and of the options used to make
+them.  Input files are identified by their path, size and modification
+time, which avoids reading multi-megabyte frames just to compute a key.
+The least recently used entries are evicted when the total size of the
+cache exceeds its budget.
+"""
+import os
+import json
+import shutil
+import hashlib
+
+from astropy import log
+
+
+def link_or_copy(source, destination):
+    """Hard-links a file, or copies it if a link cannot be made."""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class Cache(object):
+    """
+    Disk cache with a least-recently-used eviction policy.
+
+    Parameters
+    ----------
+    directory : str
+        Directory in which the cache entries are stored.
+
+    budget : int
+        Maximum total size of the entries in bytes.
+    """
+
+    def __init__(self, directory, budget):
+        self.directory = directory
+        self.budget = budget
+
+    def key(self, filenames, **options):
+        """Returns the key of the product made from files with options."""
+        inputs = []
+        for filename in filenames:
+            stat = os.stat(filename)
+            inputs.append([os.path.abspath(filename), stat.st_size,
+                           int(stat.st_mtime)])
+        description = json.dumps([inputs, options], sort_keys=True)
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def path(self, key, suffix):
+        """Returns the location of an entry."""
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def get(self, key, suffix):
+        """Returns the location of an entry, or None if it is not cached."""
+        path = self.path(key, suffix)
+        try:
+            os.utime(path, None)  # Mark as recently used
+        except OSError:
+            return None
+        return path
+
+    def fetch(self, key, suffix, filename):
+        """Copies an entry to `filename`; returns False if it is not cached."""
+        path = self.get(key, suffix)
+        if path is None:
+            return False
+        try:
+            link_or_copy(path, filename)
+        except (IOError, OSError):
+            return False  # evicted by a concurrent process
+        return True
+
+    def put(self, key, suffix, filename):
+        """Copies a file into the cache and returns the new location."""
+        path = self.path(key, suffix)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass  # dir exists
+        # Copy to a temporary name first, such that concurrent readers
+        # never see a partially written entry
+        tmpfile = '{}.tmp{}'.format(path, os.getpid())
+        link_or_copy(filename, tmpfile)
+        os.rename(tmpfile, path)
+        self.evict()
+        return path
+
+    def entries(self):
+        """Returns a list of (mtime, size, path) tuples for all entries."""
+        result = []
+        for subdir in os.listdir(self.directory):
+            subdir = os.path.join(self.directory, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for entry in os.listdir(subdir):
+                path = os.path.join(subdir, entry)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # removed by a concurrent process
+                result.append((stat.st_mtime, stat.st_size, path))
+        return result
+
+    def evict(self):
+        """Removes the least recently used entries exceeding the budget."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.budget:
+                break
+            log.debug("Evicting {} from the cache".format(path))
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # removed by a concurrent process
+            total -= size
@@ -7,7 +7,11 @@ mosaic r564465.fit Ha_conf.fits hamos.fit hamosconf.fit --skyflag=0 --verbose
 mJPEG -gray hamos.fit 20% 99.9% log -out hamos.jpg
 mJPEG -gray rmos.fit 20% 99.9% log -out rmos.jpg
 mJPEG -gray imos.fit 20% 99.9% log -out imos.jpg
-convert hamos.jpg rmos.jpg imos.jpg -set colorspace RGB -combine -set colorspace sRGB rgbmos.jpg
+after which the three jpegs are combined into a colour jpeg in-process, aligning
+them using the WCS of each mosaic (see render.render_colour).
+
+Alternatively, the 'numpy' and 'numpy-small' renderers create the JPEGs
+in-process (see render.py), reading fpack-compressed frames without funpack.
 
 To convert the result into a silly movie, use
 ffmpeg -f image2 -pattern_type glob -r 4 -i 'iphas-quicklook/*small.jpg' -c:v libx264 iphas.avi
@@ -16,23 +20,43 @@ cat $(cat list.txt) | ffmpeg -r 4 -f image2pipe -vcodec mjpeg -i - -c:v libx264
 """
 
 import os
-import subprocess
-import shlex
+import sys
 import glob
+import errno
 import json
+import socket
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 from astropy import log
 from astropy.io import fits
 from astropy.table import Table
+from astropy.wcs import WCS
+
+import render
+import executor
+import profiling
+import preflight
+from cache import Cache
+from workqueue import WorkQueue
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'data', 'image-index'))
+from imageindex import ImageIndex
+from manifest import Manifest, fingerprint
 
 
 """ CONFIGURATION CONSTANTS """
-RUN2PATH = json.load(open("/home/gb/dev/uvex-qc/data/image-index/run2path.json"))
-DIR2CONF = json.load(open("/home/gb/dev/uvex-qc/data/image-index/dir2conf.json"))
+# Maps run numbers onto images and directories onto confidence maps
+INDEX = ImageIndex("/home/gb/dev/uvex-qc/data/image-index/imageindex.db")
+FIELDS_FN = '/home/gb/dev/uvex-qc/data/casu-dqc/uvex-casu-dqc-by-field.fits'
 
 OUTPATH = '/car-data/gb/uvex-quicklook'
 DATADIR = '/car-data/gb/iphas'
 WORKDIR = '/tmp/gb-scratch'
+CACHEDIR = '/car-data/gb/uvex-quicklook-cache'
+CACHE_BUDGET = 100  # Maximum size of the cache in GB
 
 BANDS = ['u', 'g', 'r']
 MOSAIC = '/home/gb/bin/casutools/bin/mosaic'
@@ -41,6 +65,21 @@ FUNPACK = '/home/gb/bin/cfitsio3310/bin/funpack'
 MJPEG = '/soft/Montage_v3.3/bin/mJPEG'
 MSHRINK = '/soft/Montage_v3.3/bin/mShrink'
 CONVERT = '/usr/bin/convert'
+# Number of seconds after which a hung command is killed, by stage
+TIMEOUTS = {'funpack': 600,
+            'mosaic': 1800,
+            'mjpeg': 900,
+            'resize': 600,
+            'move': 120}
+# 'casutools' uses the external tools above; 'numpy' renders in-process;
+# 'numpy-small' renders in-process with a low memory footprint, but only
+# creates the small jpegs
+RENDERERS = ['casutools', 'numpy', 'numpy-small']
+# Renderer versions are stored in the manifest, so that the quicklooks are
+# recomputed when the appearance of the jpegs changes
+RENDERER_VERSIONS = {'casutools': 2,
+                     'numpy': render.VERSION,
+                     'numpy-small': render.VERSION}
 
 
 class Quicklook():
@@ -57,21 +96,54 @@ class Quicklook():
 
     fieldid : str
         Field identifier, e.g. '0009o'.
+
+    outpath : str
+        Directory where the final jpegs will be moved to.
+
+    workdir : str
+        Scratch directory for temporary files.  Instances which run
+        concurrently must not share the same directory.
+
+    renderer : str
+        One of RENDERERS.
+
+    profile : str
+        JSON-lines file to which per-stage timings will be appended.
+
+    cache : `cache.Cache`
+        Cache for mosaicked band images; None disables caching.
+
+    band_jobs : int
+        Number of bands to process concurrently.
     """
 
-    def __init__(self, run_u, run_g, run_r, time_r, fieldid, outpath=OUTPATH):
+    def __init__(self, run_u, run_g, run_r, time_r, fieldid, outpath=OUTPATH,
+                 workdir=WORKDIR, renderer='casutools', profile=None,
+                 cache=None, band_jobs=1):
+        if renderer not in RENDERERS:
+            raise ValueError('Unknown renderer: {}'.format(renderer))
         self.run_u, self.run_g, self.run_r = str(run_u), str(run_g), str(run_r)
         self.time_r = time_r
         self.fieldid = fieldid
         self.outpath = outpath
-        
-        self.workdir = WORKDIR
+        self.renderer = renderer
+        self.cache = cache
+        self.band_jobs = band_jobs
+        self.error = None
+
+        self.workdir = workdir
         timestamp = self.time_r[0:16].replace('-', '').replace(':', '').replace(' ', '-')
         self.filename_root = os.path.join(self.workdir,
                                           timestamp +
                                           "-" + self.run_r + 
                                           "-" + self.fieldid)
         self.files_to_remove = []
+        self.commands = []
+        self.profiler = profiling.Profiler(profile,
+                                           fieldid=self.fieldid,
+                                           run_r=self.run_r,
+                                           dir=os.path.basename(self.outpath),
+                                           renderer=self.renderer)
 
     def get_fits_filenames(self):
         """
@@ -79,9 +151,9 @@ class Quicklook():
         and raises an exception if they cannot be found on the filesystem.
 
         """
-        result = {'u': RUN2PATH[self.run_u],
-                  'g': RUN2PATH[self.run_g],
-                  'r': RUN2PATH[self.run_r]}
+        result = {'u': INDEX.path(self.run_u),
+                  'g': INDEX.path(self.run_g),
+                  'r': INDEX.path(self.run_r)}
         # Test if all the files exist
         for key in result.keys():
             if not os.path.exists( result[key] ):
@@ -91,20 +163,75 @@ class Quicklook():
                         result[key]) )
         return result
 
-    def execute(self, cmd):
-        """Executes a shell command and logs any errors."""
+    def get_input_filenames(self):
+        """Returns the image and confidence map files used by the field."""
+        fits_filenames = self.get_fits_filenames()
+        filenames = []
+        for band in BANDS:
+            filenames.append(fits_filenames[band])
+            filenames.append(INDEX.confmap(os.path.dirname(fits_filenames[band]), band))
+        return filenames
+
+    def get_output_filename(self):
+        """Returns the final location of the colour jpeg."""
+        return os.path.join(self.outpath,
+                            os.path.basename(self.filename_root) + '-col-small.jpg')
+
+    def get_manifest_key(self):
+        """Returns the identifier of the field in the manifest."""
+        return '{}-{}'.format(self.run_r, self.fieldid)
+
+    def get_manifest_record(self):
+        """Returns the manifest record describing the field's inputs,
+        or None if the inputs cannot be found."""
+        try:
+            inputs = fingerprint(self.get_input_filenames())
+        except Exception:
+            return None
+        return {'runs': [self.run_u, self.run_g, self.run_r],
+                'inputs': inputs,
+                'renderer': '{}-{}'.format(self.renderer,
+                                           RENDERER_VERSIONS[self.renderer])}
+
+    def execute(self, cmd, stage=None, inputs=(), outputs=(), **extra):
+        """Executes a command and raises an exception if it fails.
+
+        Parameters
+        ----------
+        cmd : str
+            Command line.
+
+        stage : str
+            Name of the processing stage, which sets the timeout (see
+            TIMEOUTS).  The outcome of the command is recorded in the
+            `commands` attribute.
+
+        inputs, outputs, **extra
+            Passed on to `Profiler.stage`.
+        """
         log.debug(cmd)
-        p = subprocess.Popen(shlex.split(cmd), 
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
-        stdout = p.stdout.read().strip()
-        stderr = p.stderr.read().strip()
-        if stderr:
+        with self.profiler.stage(stage, inputs=inputs, outputs=outputs,
+                                 **extra) as record:
+            result = executor.run(cmd, timeout=TIMEOUTS.get(stage))
+            record['cpu_time'] = result.user_time + result.system_time
+            record['peak_rss_kb'] = result.maxrss
+            record['exit_status'] = result.returncode
+        self.commands.append((stage, result))
+        log.debug("{} took {:.1f}s wall, {:.1f}s cpu, exit status {}".format(
+                    stage, result.wall_time,
+                    result.user_time + result.system_time, result.returncode))
+        if result.timed_out:
+            raise Exception("Timeout in quicklook.execute after {}s: "
+                            "CMD={{{}}}".format(TIMEOUTS.get(stage), cmd))
+        if result.returncode != 0:
             raise Exception("Error detected in quicklook.execute: "
-                            "STDERR={%s} STDOUT={%s} CMD={%s}" % (
-                                stderr, stdout, cmd))
-        if stdout:
-            log.debug( stdout )
+                            "EXIT={%s} STDERR={%s} STDOUT={%s} CMD={%s}" % (
+                                result.returncode, result.stderr,
+                                result.stdout, cmd))
+        if result.stderr:
+            log.warning(result.stderr)
+        if result.stdout:
+            log.debug(result.stdout)
         return True
 
     def setup_workdir(self):
@@ -127,7 +254,7 @@ class Quicklook():
             cmd = '/bin/mv %s %s' % (
                     filename,
                     self.outpath)
-            self.execute(cmd)
+            self.execute(cmd, stage='move', inputs=[filename])
 
     def clean_workdir(self):
         """Removes temporary files from the working directory."""
@@ -135,131 +262,583 @@ class Quicklook():
         #for filename in glob.iglob(self.workdir + '/*' + self.fieldid + '*'):
         #    files_to_remove.append(filename)
 
-        # Delete the leftover fits files
+        # Delete the leftover fits files, ignoring any which are already gone
         for filename in self.files_to_remove:
-            cmd = '/bin/chmod +w %s' % filename
-            self.execute(cmd)
-            cmd = '/bin/rm %s' % filename
-            self.execute(cmd)
-            
+            try:
+                os.remove(filename)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        self.files_to_remove = []
+
     def compute_jpegs(self):
+        """Creates the single-band and colour jpegs in the working directory."""
         assert( os.path.exists(self.workdir) )
-        fits_filenames = self.get_fits_filenames()
-        
-        for band in BANDS:
-            filename_fits = self.filename_root + '-' + band + '.fit'
-            filename_conf = self.filename_root + '-' + band + '-conf.fit'
+        if self.renderer.startswith('numpy'):
+            self.compute_jpegs_numpy()
+        else:
+            self.compute_jpegs_casutools()
+
+    def read_band(self, band, filename, width=None):
+        """Returns the mosaic, stretch limits and WCS of a band, see
+        `render.read_band`, using the cache if one is configured."""
+        if self.cache is None:
+            return render.read_band(filename, width=width)
+
+        key = self.cache.key([filename], product='band', width=width,
+                             version=render.VERSION)
+        path = self.cache.get(key, '.npz')
+        if path is not None:
+            try:
+                with np.load(path) as npz:
+                    header = fits.Header.fromstring(str(npz['wcs']))
+                    return npz['mosaic'], tuple(npz['limits']), WCS(header)
+            except (IOError, OSError, ValueError):
+                pass  # evicted by a concurrent process
+
+        mosaic, limits, wcs = render.read_band(filename, width=width)
+        tmpfile = self.filename_root + '-' + band + '-cache.npz'
+        np.savez(tmpfile, mosaic=mosaic, limits=limits,
+                 wcs=wcs.to_header_string())
+        self.cache.put(key, '.npz', tmpfile)
+        os.remove(tmpfile)
+        return mosaic, limits, wcs
+
+    def map_bands(self, func, fits_filenames):
+        """Calls `func(band, filename)` for each band.
+
+        If `band_jobs` > 1, the bands are processed concurrently in threads,
+        which is effective because the work is done by external commands or
+        by NumPy and Pillow calls which release the GIL.
+
+        Returns
+        -------
+        results : dict
+            Maps bands onto the return values of `func`.
+        """
+        if self.band_jobs <= 1:
+            return {band: func(band, fits_filenames[band]) for band in BANDS}
+        with ThreadPoolExecutor(max_workers=self.band_jobs) as pool:
+            futures = {band: pool.submit(func, band, fits_filenames[band])
+                       for band in BANDS}
+            # Raises the exception of the first failed band, if any
+            return {band: futures[band].result() for band in BANDS}
+
+    def compute_band_numpy(self, band, filename):
+        """Creates the jpegs of a single band in-process.
+
+        Returns
+        -------
+        image, wcs : array of uint8, `astropy.wcs.WCS`
+            The stretched image and its world coordinate system.
+        """
+        small_only = (self.renderer == 'numpy-small')
+        width = render.SMALL_WIDTH if small_only else None
+
+        filename_jpg = None
+        filename_jpg_small = self.filename_root + '-' + band + '-small.jpg'
+        outputs = [filename_jpg_small]
+        if not small_only:
             filename_jpg = self.filename_root + '-' + band + '.jpg'
-            filename_jpg_small = self.filename_root + '-' +band + '-small.jpg'     
+            outputs.append(filename_jpg)
+        with self.profiler.stage('render', band=band, inputs=[filename],
+                                 outputs=outputs):
+            mosaic, limits, wcs = self.read_band(band, filename, width=width)
+            image = render.write_band(mosaic, limits, filename_jpg_small,
+                                      filename_jpg=filename_jpg)
+        if filename_jpg is not None:
+            self.files_to_remove.append(filename_jpg)
+        return image, wcs
+
+    def compute_jpegs_numpy(self):
+        """Creates the jpegs in-process, without calling external tools."""
+        fits_filenames = self.get_fits_filenames()
+        images = self.map_bands(self.compute_band_numpy, fits_filenames)
+
+        # Final color mosaic, aligned using the WCS of each band
+        filename_jpg_small = self.filename_root + '-col-small.jpg'
+        with self.profiler.stage('combine', outputs=[filename_jpg_small]):
+            render.render_colour(images['r'], images['g'], images['u'],
+                                 filename_jpg_small)
+
+    def compute_band_casutools(self, band, filename):
+        """Creates the jpegs of a single band using CASUtools and Montage."""
+        filename_fits = self.filename_root + '-' + band + '.fit'
+        filename_conf = self.filename_root + '-' + band + '-conf.fit'
+        filename_jpg = self.filename_root + '-' + band + '.jpg'
+        filename_jpg_small = self.filename_root + '-' +band + '-small.jpg'     
+
+        # CASUTools/Mosaic
+        confmap = INDEX.confmap(os.path.dirname(filename), band)
+
+        # Re-use the mosaicked frame if it is in the cache
+        cached, key = False, None
+        if self.cache is not None:
+            key = self.cache.key([filename, confmap],
+                                 product='mosaic', tool=MOSAIC,
+                                 options='--skyflag=0 EQUINOX=2000.0')
+            with self.profiler.stage('cache', band=band,
+                                     outputs=[filename_fits]):
+                cached = self.cache.fetch(key, '.fit', filename_fits)
+            if cached:
+                self.files_to_remove.append(filename_fits)
+        if not cached:
+            # Mosaic cannot read tile-compressed frames
+            filename_in = filename
+            if filename.endswith('.fz'):
+                filename_in = self.filename_root + '-' + band + '-in.fit'
+                cmd = '%s -O %s %s' % (FUNPACK, filename_in, filename)
+                self.execute(cmd, stage='funpack', band=band,
+                             inputs=[filename], outputs=[filename_in])
+                self.files_to_remove.append(filename_in)
 
-            # CASUTools/Mosaic
-            confmap = DIR2CONF[os.path.dirname(fits_filenames[band])][band]
             cmd = '%s %s %s %s %s --skyflag=0' % (
                 MOSAIC,
-                fits_filenames[band],
+                filename_in,
                 confmap,
                 filename_fits,
                 filename_conf )
-            self.execute(cmd)
-            self.files_to_remove.append(filename_conf)
+            self.execute(cmd, stage='mosaic', band=band,
+                         inputs=[filename_in, confmap],
+                         outputs=[filename_fits, filename_conf])
             self.files_to_remove.append(filename_fits)
+            self.files_to_remove.append(filename_conf)
 
             # Montage requires the equinox keyword to be '2000.0'
             # but CASUtools sets the value 'J2000.0'
-            myfits = fits.open(filename_fits)
-            myfits[0].header['EQUINOX'] = '2000.0'
-            myfits.writeto(filename_fits, clobber=True)
-
-            # Montage/mJPEG
-            cmd = '%s -gray %s 25%% 99.9%% log -out %s' % (
-                    MJPEG,
-                    filename_fits,
-                    filename_jpg )
-            self.execute(cmd)
-            self.files_to_remove.append(filename_jpg)
-
-            # Make a smaller version, too
-            cmd = '%s %s -resize 600 -quality 70 %s' % (
-                    CONVERT,
-                    filename_jpg,
-                    filename_jpg_small )
-            self.execute(cmd)
-
-            """
-            # Compress the mosaicked FITS file
-            cmd = '%s -D -Y %s' % (
-                    FPACK,
-                    filename_fits )
-            self.execute(cmd)
-            """
-            """
-            # Shrink the mosaicked FITS file
-            cmd = '%s %s %s 6' % (
-                    MSHRINK,
-                    filename_fits,
-                    filename_fits )
-            self.execute(cmd)
-            """
-
-        # Final color mosaic
-        # We have to ensure that the channels have the same number of pixels
-        cmd = '%s %s %s %s -set colorspace RGB -combine -set colorspace sRGB %s' % (
-                CONVERT,
-                self.filename_root + '-r.jpg[6210x6145+0+0]',
-                self.filename_root + '-g.jpg[6210x6145+0+0]', 
-                self.filename_root + '-u.jpg[6210x6145+0+0]', 
-                self.filename_root + '-col.jpg'
-                )
-        self.execute(cmd)
-        self.files_to_remove.append(self.filename_root + '-col.jpg')
+            with self.profiler.stage('equinox', band=band,
+                                     inputs=[filename_fits],
+                                     outputs=[filename_fits]):
+                myfits = fits.open(filename_fits)
+                myfits[0].header['EQUINOX'] = '2000.0'
+                myfits.writeto(filename_fits, clobber=True)
+            if key is not None:
+                self.cache.put(key, '.fit', filename_fits)
+
+        # Montage/mJPEG
+        cmd = '%s -gray %s 25%% 99.9%% log -out %s' % (
+                MJPEG,
+                filename_fits,
+                filename_jpg )
+        self.execute(cmd, stage='mjpeg', band=band,
+                     inputs=[filename_fits], outputs=[filename_jpg])
+        self.files_to_remove.append(filename_jpg)
 
-        # Small version
+        # Make a smaller version, too
         cmd = '%s %s -resize 600 -quality 70 %s' % (
                 CONVERT,
-                self.filename_root + '-col.jpg',
-                self.filename_root + '-col-small.jpg')
+                filename_jpg,
+                filename_jpg_small )
+        self.execute(cmd, stage='resize', band=band,
+                     inputs=[filename_jpg], outputs=[filename_jpg_small])
+
+        """
+        # Compress the mosaicked FITS file
+        cmd = '%s -D -Y %s' % (
+                FPACK,
+                filename_fits )
+        self.execute(cmd)
+        """
+        """
+        # Shrink the mosaicked FITS file
+        cmd = '%s %s %s 6' % (
+                MSHRINK,
+                filename_fits,
+                filename_fits )
         self.execute(cmd)
+        """
+
+    def compute_jpegs_casutools(self):
+        """Creates the jpegs using CASUtools/mosaic, Montage and ImageMagick."""
+        fits_filenames = self.get_fits_filenames()
+        self.map_bands(self.compute_band_casutools, fits_filenames)
+
+        # Final color mosaic, aligned using the WCS of each band's mosaic
+        # rather than by cropping the channels to the same number of pixels
+        filename_jpg_small = self.filename_root + '-col-small.jpg'
+        inputs = [self.filename_root + '-' + band + suffix
+                  for band in BANDS for suffix in ['.jpg', '.fit']]
+        with self.profiler.stage('combine', inputs=inputs,
+                                 outputs=[filename_jpg_small]):
+            images = {}
+            for band in BANDS:
+                filename_fits = self.filename_root + '-' + band + '.fit'
+                image = render.read_jpeg(self.filename_root + '-' + band + '.jpg')
+                header = fits.getheader(filename_fits)
+                if image.shape != (header['NAXIS2'], header['NAXIS1']):
+                    raise Exception('%s does not match the size of %s' % (
+                                        self.filename_root + '-' + band + '.jpg',
+                                        filename_fits))
+                images[band] = (image, WCS(header))
+            render.render_colour(images['r'], images['g'], images['u'],
+                                 filename_jpg_small)
 
     def run(self):
         """Main execution loop"""
         log.info("Creating quicklook for {} ({},{},{})".format(
                      self.fieldid, self.run_u, self.run_g, self.run_r))
         try:
-            self.setup_workdir()
-            self.compute_jpegs()
-            self.move_jpegs()
-            self.clean_workdir()
+            with self.profiler.stage('total'):
+                self.setup_workdir()
+                self.compute_jpegs()
+                self.move_jpegs()
+                self.clean_workdir()
             return True
         except Exception as e:
             log.error('Quicklook.run({}) aborted with exception: "{}"'.format(self.run_r, e))
-            self.clean_workdir()
+            self.error = str(e)
+            try:
+                self.clean_workdir()
+            except OSError as e:
+                log.warning('Quicklook.run({}) could not clean up: "{}"'.format(self.run_r, e))
             #raise e
             return False
+        finally:
+            self.profiler.write()
+
+
+def _init_worker(workdir):
+    """Gives each worker process in the pool its own scratch directory."""
+    global WORKDIR
+    WORKDIR = os.path.join(workdir, 'worker-{}'.format(os.getpid()))
+
+
+def _run_quicklook(kwargs):
+    """Runs a single Quicklook and returns a (fieldid, run_r, error) tuple."""
+    ql = Quicklook(workdir=WORKDIR, **kwargs)
+    success = ql.run()
+    if success:
+        return (ql.fieldid, ql.run_r, None)
+    return (ql.fieldid, ql.run_r, ql.error or 'unknown error')
+
+
+def summarize(results):
+    """Logs the number of successful and failed quicklooks.
+
+    Parameters
+    ----------
+    results : list of (fieldid, run_r, error) tuples
+        As returned by `create_quicklooks`; error is None on success.
+    """
+    failures = [r for r in results if r[2] is not None]
+    log.info("Created {} out of {} quicklooks; {} failed.".format(
+                len(results) - len(failures), len(results), len(failures)))
+    for fieldid, run_r, error in sorted(failures):
+        log.warning("Failed: {} ({}): {}".format(fieldid, run_r, error))
+
 
+def run_quicklooks(tasks, jobs=1):
+    """Runs quicklooks, yielding (fieldid, run_r, error) tuples as they finish.
+
+    Parameters
+    ----------
+    tasks : list of dict
+        Keyword arguments to pass to `Quicklook`.
+
+    jobs : int
+        Number of quicklooks to compute in parallel.
+    """
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, initializer=_init_worker,
+                                    initargs=(WORKDIR,))
+        try:
+            for result in pool.imap_unordered(_run_quicklook, tasks):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for kwargs in tasks:
+            yield _run_quicklook(kwargs)
+
+
+def read_fields(dirname):
+    """Returns the fields observed in u, g and r in a given month.
+
+    Only the rows of the month are converted into a table; the rest of the
+    memory-mapped FITS table is never loaded.
+    """
+    with fits.open(FIELDS_FN, memmap=True) as hdulist:
+        data = hdulist[1].data
+        mask = (
+                (data['dir'] == dirname)
+                & (data['runno_u'] != '')
+                & (data['runno_g'] != '')
+                & (data['runno_r'] != '')
+                )
+        return Table(data[mask])
+
+
+def plan_month(dirname, renderer='casutools', force=False, profile=None,
+               cache=None, band_jobs=1, keys=None):
+    """Returns the fields of a month which have to be (re)computed.
+
+    Fields whose images or confidence maps cannot be found are reported
+    as unavailable.  Fields which are recorded in the manifest of the output
+    directory as having been completed with the same inputs and renderer
+    are skipped, unless `force` is True.  See `create_quicklooks` for the
+    parameters.
+
+    Returns
+    -------
+    unavailable : list of (fieldid, run_r, reason) tuples
+        Fields with missing inputs.
+
+    todo : list of dict
+        Keyword arguments to pass to `Quicklook`, one per field.
+
+    records : dict
+        Maps the manifest keys of the fields in `todo` onto their
+        manifest records.
+    """
+    fields = read_fields(dirname)
+    if keys is not None:
+        keys = set(keys)
+        fields = fields[np.array(['{}-{}'.format(field['runno_r'], field['field'])
+                                  in keys for field in fields], dtype=bool)]
+    ready, missing = preflight.plan(fields, INDEX, bands=BANDS)
+    log.info("Preflight of {}: {} fields ready, {} with missing inputs.".format(
+                dirname, len(ready), len(missing)))
+    unavailable = [(field['field'], field['runno_r'], field['reason'])
+                   for field in missing]
 
-def create_quicklooks(dirname):
     outpath = os.path.join(OUTPATH, dirname)
-    try:
-        os.makedirs(outpath)
-    except OSError as exception:
-        pass  # dir exists
-
-    t = Table.read('/home/gb/dev/uvex-qc/data/casu-dqc/uvex-casu-dqc-by-field.fits')
-    mask = (
-            (t['dir'] == dirname)
-            & (t['runno_u'] != '')
-            & (t['runno_g'] != '')
-            & (t['runno_r'] != '')
-            )
-    for field in t[mask]:
-        ql = Quicklook(field['runno_u'], field['runno_g'], field['runno_r'],
-                       field['time_r'], field['field'], outpath=outpath)
-        ql.run()
-   
+    tasks = [dict(run_u=field['runno_u'], run_g=field['runno_g'],
+                  run_r=field['runno_r'], time_r=field['time_r'],
+                  fieldid=field['field'], outpath=outpath,
+                  renderer=renderer, profile=profile, cache=cache,
+                  band_jobs=band_jobs)
+             for field in ready]
+
+    # Skip the fields which are up to date
+    manifest = Manifest(outpath)
+    records, todo = {}, []
+    for kwargs in tasks:
+        ql = Quicklook(**kwargs)
+        key, record = ql.get_manifest_key(), ql.get_manifest_record()
+        if not force and manifest.is_done(key, record,
+                                          ql.get_output_filename()):
+            continue
+        records[key] = record
+        todo.append(kwargs)
+    log.info("Skipping {} out of {} fields of {} which are up to date.".format(
+                len(tasks) - len(todo), len(tasks), dirname))
+    return unavailable, todo, records
+
+
+def create_quicklooks(dirname, jobs=1, renderer='casutools', force=False,
+                      profile=None, cache=None, band_jobs=1, dry_run=False,
+                      keys=None):
+    """Creates the quicklooks for all the fields observed in a given month.
+
+    Fields whose images or confidence maps cannot be found are reported
+    and skipped before any work is launched.  Fields which are recorded in
+    the manifest of the output directory as having been completed with the
+    same inputs and renderer are skipped as well.
+
+    Parameters
+    ----------
+    dirname : str
+        Name of the month directory, e.g. 'aug2010'.
+
+    jobs : int
+        Number of quicklooks to compute in parallel.
+
+    renderer : str
+        One of RENDERERS.
+
+    force : bool
+        If True, recompute fields which are up to date.
+
+    profile : str
+        JSON-lines file to which per-stage timings will be appended.
+
+    cache : `cache.Cache`
+        Cache for mosaicked band images; None disables caching.
+
+    band_jobs : int
+        Number of bands to process concurrently within each field.
+
+    dry_run : bool
+        If True, only report which fields are ready and which are missing.
+
+    keys : collection of str
+        If given, only process the fields with these manifest keys,
+        i.e. '<run_r>-<fieldid>', as listed in a task manifest.
+
+    Returns
+    -------
+    results : list of (fieldid, run_r, error) tuples
+    """
+    return create_task_quicklooks({dirname: keys}, jobs=jobs,
+                                  renderer=renderer, force=force,
+                                  profile=profile, cache=cache,
+                                  band_jobs=band_jobs, dry_run=dry_run)
+
+
+def create_task_quicklooks(months, jobs=1, dry_run=False, **options):
+    """Creates the quicklooks of several months using a single pool.
+
+    A task of a job array written by `plan-cluster-jobs.py` typically holds
+    a few fields of many months, so the fields of all months are computed
+    by the same pool of `jobs` workers rather than one month after another.
+
+    Parameters
+    ----------
+    months : dict
+        Maps month directories onto the manifest keys of the fields to
+        process, or onto None to process all the fields of the month.
+
+    jobs, dry_run, **options
+        See `create_quicklooks`.
+
+    Returns
+    -------
+    results : list of (fieldid, run_r, error) tuples
+    """
+    results, todo, records, outpaths = [], [], {}, {}
+    for dirname, keys in sorted(months.items()):
+        unavailable, month_todo, month_records = plan_month(dirname,
+                                                            keys=keys,
+                                                            **options)
+        results.extend(unavailable)
+        todo.extend(month_todo)
+        records.update(month_records)
+        outpaths[dirname] = os.path.join(OUTPATH, dirname)
+    if dry_run:
+        for fieldid, run_r, reason in results:
+            log.warning("Missing: {} ({}): {}".format(fieldid, run_r, reason))
+        return results
+
+    for outpath in outpaths.values():
+        try:
+            os.makedirs(outpath)
+        except OSError as exception:
+            pass  # dir exists
+
+    manifests = dict((outpath, Manifest(outpath))
+                     for outpath in outpaths.values())
+    key_outpath = dict(('{}-{}'.format(kwargs['run_r'], kwargs['fieldid']),
+                        kwargs['outpath']) for kwargs in todo)
+    for fieldid, run_r, error in run_quicklooks(todo, jobs=jobs):
+        key = '{}-{}'.format(run_r, fieldid)
+        if error is None and records[key] is not None:
+            manifests[key_outpath[key]].update(key, records[key])
+        results.append((fieldid, run_r, error))
+
+    summarize(results)
+    return results
+
+
+def fill_queue(queue, dirname):
+    """Adds the fields of a month which pass the preflight check to a queue."""
+    ready, missing = preflight.plan(read_fields(dirname), INDEX, bands=BANDS)
+    count = queue.fill(dirname, ['{}-{}'.format(field['runno_r'], field['field'])
+                                 for field in ready])
+    log.info("Queued {} fields of {}; {} have missing inputs.".format(
+                count, dirname, len(missing)))
+
+
+def _queue_worker(queue, options):
+    """Processes fields claimed from a queue until none are left."""
+    worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+    while True:
+        task = queue.claim(worker)
+        if task is None:
+            break
+        dirname, key = task
+        with queue.leased(worker, task):
+            try:
+                results = create_quicklooks(dirname, keys=[key], **options)
+                if results:
+                    error = results[0][2]
+                elif key in Manifest(os.path.join(OUTPATH, dirname)).entries:
+                    error = None  # Skipped because it is up to date
+                else:
+                    error = 'field not found'
+            except Exception as e:
+                error = str(e)
+        queue.release(worker, task, error=error)
+
+
+def _run_queue_worker(queue, options):
+    """Runs a queue worker in a process with its own scratch directory."""
+    _init_worker(WORKDIR)
+    _queue_worker(queue, options)
+
+
+def work_queue(queue, jobs=1, **options):
+    """Claims and processes fields from a `workqueue.WorkQueue`.
+
+    Parameters
+    ----------
+    queue : `workqueue.WorkQueue`
+
+    jobs : int
+        Number of worker processes which claim fields concurrently.
+
+    **options
+        Passed on to `create_quicklooks`.
+    """
+    if jobs == 1:
+        _queue_worker(queue, options)
+    else:
+        workers = [multiprocessing.Process(target=_run_queue_worker,
+                                           args=(queue, options))
+                   for _ in range(jobs)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    log.info("Queue: {}".format(queue.counts()))
+
 
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser(description="Creates uvex colour JPGs for a given month.")
-    parser.add_argument("dirname")
+    parser.add_argument("dirname", nargs="?")
+    parser.add_argument("--task", metavar="FILE",
+                        help="process the fields listed in a task manifest "
+                             "written by plan-cluster-jobs.py")
+    parser.add_argument("--queue", metavar="FILE",
+                        help="claim fields from a work queue database; "
+                             "if dirname is given, its fields are queued first")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of quicklooks to compute in parallel")
+    parser.add_argument("--band-jobs", type=int, default=1,
+                        help="number of bands to process concurrently per field")
+    parser.add_argument("--renderer", choices=RENDERERS, default='casutools',
+                        help="render with external tools or in-process")
+    parser.add_argument("--force", action="store_true",
+                        help="recompute fields which are up to date")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="append per-stage timings to a JSON-lines file")
+    parser.add_argument("--cache", action="store_true",
+                        help="cache mosaicked band images in CACHEDIR")
+    parser.add_argument("--cache-dir", default=CACHEDIR,
+                        help="cache directory (default: %(default)s)")
+    parser.add_argument("--cache-budget", type=float, default=CACHE_BUDGET,
+                        help="maximum size of the cache in GB (default: %(default)s)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only report which fields have missing inputs")
     args = parser.parse_args()
-    create_quicklooks(args.dirname)
+    cache = None
+    if args.cache:
+        cache = Cache(args.cache_dir, int(args.cache_budget * 1e9))
+    options = dict(renderer=args.renderer, force=args.force,
+                   profile=args.profile, cache=cache, band_jobs=args.band_jobs)
+    if args.queue is not None:
+        queue = WorkQueue(args.queue)
+        if args.dirname is not None:
+            fill_queue(queue, args.dirname)
+        work_queue(queue, jobs=args.jobs, **options)
+    else:
+        if args.task is not None:
+            with open(args.task) as fh:
+                months = json.load(fh)['fields']
+        elif args.dirname is not None:
+            months = {args.dirname: None}
+        else:
+            parser.error("either dirname, --task or --queue is required")
+        create_task_quicklooks(months, jobs=args.jobs, dry_run=args.dry_run,
+                               **options)
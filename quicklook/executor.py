@@ -0,0 +1,97 @@
+"""
+Runs external commands with a timeout and records their resource usage.
+
+Both output streams of a command are read concurrently, such that a command
+which writes a lot to stderr cannot deadlock on a full pipe.  Commands which
+exceed their timeout are killed, together with any processes they spawned.
+"""
+import os
+import time
+import shlex
+import signal
+import threading
+import subprocess
+from collections import namedtuple
+
+
+CommandResult = namedtuple('CommandResult',
+                           ['cmd', 'returncode', 'timed_out', 'wall_time',
+                            'user_time', 'system_time', 'maxrss',
+                            'stdout', 'stderr'])
+CommandResult.__doc__ = """Outcome of a command.
+
+returncode is negative if the command was terminated by a signal;
+times are in seconds and maxrss, the peak resident set size of the
+command, is in kilobytes."""
+
+
+def _drain(stream, chunks):
+    """Reads a stream until EOF."""
+    chunks.append(stream.read())
+    stream.close()
+
+
+def run(cmd, timeout=None):
+    """Runs a command and waits for it to finish.
+
+    Parameters
+    ----------
+    cmd : str
+        Command line; it is split using shell syntax but not passed to a shell.
+
+    timeout : float
+        Number of seconds after which the command is killed.
+
+    Returns
+    -------
+    result : `CommandResult`
+    """
+    start = time.time()
+    # Start a new session so that the whole process group can be killed
+    p = subprocess.Popen(shlex.split(cmd),
+                         stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE,
+                         start_new_session=True)
+    stdout, stderr = [], []
+    readers = [threading.Thread(target=_drain, args=(p.stdout, stdout)),
+               threading.Thread(target=_drain, args=(p.stderr, stderr))]
+    for reader in readers:
+        reader.daemon = True
+        reader.start()
+
+    lock = threading.Lock()
+    state = {'finished': False, 'timed_out': False}
+
+    def kill():
+        with lock:
+            if not state['finished']:
+                state['timed_out'] = True
+                os.killpg(p.pid, signal.SIGKILL)
+
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+
+    # Wait for the command to exit without reaping it, so that the timer
+    # can never signal a recycled process id
+    os.waitid(os.P_PID, p.pid, os.WEXITED | os.WNOWAIT)
+    with lock:
+        state['finished'] = True
+    if timer is not None:
+        timer.cancel()
+    _, status, rusage = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(status)
+    for reader in readers:
+        reader.join()
+
+    return CommandResult(cmd=cmd,
+                         returncode=p.returncode,
+                         timed_out=state['timed_out'],
+                         wall_time=time.time() - start,
+                         user_time=rusage.ru_utime,
+                         system_time=rusage.ru_stime,
+                         maxrss=rusage.ru_maxrss,
+                         stdout=b''.join(stdout).decode(errors='replace').strip(),
+                         stderr=b''.join(stderr).decode(errors='replace').strip())
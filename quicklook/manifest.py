@@ -0,0 +1,93 @@
+"""
+Keeps track of the quicklooks which have been completed.
+
+Each output directory holds a `manifest.json` file which records, for every
+field, the run numbers, the size and modification time of the input files,
+and the version of the renderer which produced the jpegs.  A field is
+up to date if its record is unchanged and its colour jpeg exists.
+
+Several processes may complete fields in the same directory at once, e.g.
+queue workers or the tasks of a job array.  Each of them only writes the
+records it changed itself, merging them into the manifest on disk while
+holding a lock on `manifest.json.lock`.
+"""
+import os
+import json
+import fcntl
+
+
+MANIFEST_FN = 'manifest.json'
+LOCK_SUFFIX = '.lock'
+
+
+def fingerprint(filenames):
+    """Returns a dictionary mapping filenames onto [size, mtime] pairs."""
+    result = {}
+    for filename in filenames:
+        stat = os.stat(filename)
+        result[filename] = [stat.st_size, int(stat.st_mtime)]
+    return result
+
+
+class Manifest(object):
+    """
+    Records the quicklooks completed in an output directory.
+
+    Parameters
+    ----------
+    outpath : str
+        Output directory of the quicklooks.
+    """
+
+    def __init__(self, outpath):
+        self.outpath = outpath
+        self.filename = os.path.join(outpath, MANIFEST_FN)
+        self.entries = self._read()
+        self._changed = {}  # Records to merge into the manifest on disk
+
+    def _read(self):
+        if not os.path.exists(self.filename):
+            return {}
+        with open(self.filename) as fh:
+            return json.load(fh)
+
+    def is_done(self, key, record, output):
+        """Returns True if a field has been completed with the same inputs.
+
+        Parameters
+        ----------
+        key : str
+            Unique identifier of the field.
+
+        record : dict
+            Expected record, i.e. run numbers, input fingerprints and
+            renderer version.
+
+        output : str
+            Path to the jpeg which must exist for the field to be done.
+        """
+        return (record is not None
+                and self.entries.get(key) == record
+                and os.path.exists(output))
+
+    def update(self, key, record):
+        """Records a completed field and writes the manifest to disk."""
+        self.entries[key] = record
+        self._changed[key] = record
+        self.save()
+
+    def save(self):
+        """Merges the records changed by this process into the manifest
+        on disk, which is written atomically to survive crashes."""
+        # The manifest itself is replaced by a rename, so the lock is taken
+        # on a separate file which is never replaced
+        with open(self.filename + LOCK_SUFFIX, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = self._read()
+            entries.update(self._changed)
+            tmpfile = '{}.tmp{}'.format(self.filename, os.getpid())
+            with open(tmpfile, 'w') as fh:
+                json.dump(entries, fh, indent=2, sort_keys=True)
+            os.rename(tmpfile, self.filename)
+        self.entries = entries
+        self._changed = {}
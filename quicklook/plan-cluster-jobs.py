@@ -0,0 +1,206 @@
+"""
+Packs the quicklook fields of all months into a PBS job array of balanced tasks.
+
+Unlike `print-cluster-jobs.py`, which submits one job per month, the fields
+are distributed over N tasks such that every task has about the same amount
+of work.  The cost of a field is the time it took previously, as recorded
+by `create-quicklooks.py --profile`; fields which have not been profiled
+are given the median recorded cost.  Every task computes its fields using
+a single pool of `--jobs` workers, whatever month they belong to.
+
+The planner writes one manifest per task, `task-<i>.json`, which lists the
+fields of the task by month, and a job-array script which runs
+`create-quicklooks.py --task task-${PBS_ARRAYID}.json`.
+"""
+import os
+import json
+import heapq
+
+import numpy as np
+from astropy import log
+from astropy.io import fits
+from astropy.table import Table
+
+from profiling import read_records
+
+
+FIELDS_FN = '/home/gb/dev/uvex-qc/data/casu-dqc/uvex-casu-dqc-by-field.fits'
+BANDS = ['u', 'g', 'r']
+DEFAULT_FIELD_COST = 360.  # Seconds per field if no profile is available
+
+PBS_TEMPLATE = """#!/bin/bash -f
+# Creates quicklook images for one task of a balanced job array
+#PBS -l nodes=1:ppn={jobs}
+#PBS -t 0-{last_task}
+#PBS -k oe
+#PBS -q cmain
+#PBS -l walltime={walltime}
+#PBS -m a
+
+echo `date`
+echo ------------------------------------------------------
+echo -n 'Job is running on node '; cat $PBS_NODEFILE
+echo PBS: job identifier is $PBS_JOBID
+echo PBS: array ID is $PBS_ARRAYID
+echo ------------------------------------------------------
+
+export LD_LIBRARY_PATH=/home/gb/bin/wcslib-4.15/lib:$LD_LIBRARY_PATH
+
+# Activate the right Python environment
+export PATH=/home/gb/bin/anaconda/bin:$PATH
+source activate surveytools
+
+# Run the procedure
+ionice -c3 nice -n15 python /home/gb/dev/uvex-qc/quicklook/create-quicklooks.py --jobs {jobs} --task {taskdir}/task-${{PBS_ARRAYID}}.json
+
+echo ------------------------------------------------------
+echo Job ends
+echo `date`
+"""
+
+
+def read_all_fields(filename=FIELDS_FN):
+    """Returns the dir, field, runs of all fields observed in u, g and r."""
+    with fits.open(filename, memmap=True) as hdulist:
+        data = hdulist[1].data
+        mask = np.ones(len(data), dtype=bool)
+        for band in BANDS:
+            mask &= data['runno_' + band] != ''
+        return Table(data[mask])
+
+
+def field_key(runno_r, fieldid):
+    """Returns the identifier of a field, as used in the quicklook manifest."""
+    return '{}-{}'.format(runno_r, fieldid)
+
+
+def estimate_costs(fields, profiles=()):
+    """Returns the estimated cost of each field in seconds.
+
+    Fields which appear in the profiles are given the duration recorded
+    for them; the others are given the median recorded duration, or
+    `DEFAULT_FIELD_COST` if there are no profiles.
+    """
+    recorded = {}
+    for rec in read_records(profiles):
+        if rec['stage'] == 'total':
+            recorded[field_key(rec['run_r'], rec['fieldid'])] = rec['duration']
+    field_cost = DEFAULT_FIELD_COST
+    if len(recorded) > 0:
+        field_cost = np.median(list(recorded.values()))
+        log.info("Using {} recorded field durations; "
+                 "median cost per field is {:.0f}s".format(len(recorded),
+                                                          field_cost))
+
+    keys = [field_key(run, fieldid) for run, fieldid
+            in zip(fields['runno_r'], fields['field'])]
+    return np.array([recorded.get(key, field_cost) for key in keys])
+
+
+def pack(costs, ntasks):
+    """Assigns items to tasks, most expensive first, always choosing the
+    task with the least work so far.
+
+    Returns
+    -------
+    assignment : array of int
+        Task number of every item.
+    """
+    assignment = np.empty(len(costs), dtype=int)
+    loads = [(0., task) for task in range(ntasks)]
+    for idx in np.argsort(costs)[::-1]:
+        load, task = heapq.heappop(loads)
+        assignment[idx] = task
+        heapq.heappush(loads, (load + costs[idx], task))
+    return assignment
+
+
+def format_walltime(seconds):
+    """Returns a duration in the PBS HH:MM:SS format."""
+    seconds = int(np.ceil(seconds))
+    return '{:02d}:{:02d}:{:02d}'.format(seconds // 3600,
+                                         (seconds // 60) % 60,
+                                         seconds % 60)
+
+
+def plan_jobs(ntasks, taskdir, jobs=1, profiles=(), safety=2.):
+    """Writes the task manifests and the job-array script.
+
+    Parameters
+    ----------
+    ntasks : int
+        Number of tasks in the job array.
+
+    taskdir : str
+        Directory to write `task-<i>.json` and `quicklook-array.pbs` to.
+
+    jobs : int
+        Number of quicklooks each task computes in parallel.
+
+    profiles : list of str
+        JSON-lines profile files used to estimate the cost of fields.
+
+    safety : float
+        Factor by which the walltime exceeds the estimated duration of the
+        longest task.
+
+    Returns
+    -------
+    filename : str
+        Path to the job-array script.
+    """
+    fields = read_all_fields()
+    costs = estimate_costs(fields, profiles)
+    ntasks = min(ntasks, len(fields))
+    assignment = pack(costs, ntasks)
+
+    try:
+        os.makedirs(taskdir)
+    except OSError:
+        pass  # dir exists
+    loads = np.zeros(ntasks)
+    durations = np.zeros(ntasks)
+    for task in range(ntasks):
+        members = np.where(assignment == task)[0]
+        loads[task] = costs[members].sum()
+        # The fields of a task share one pool of `jobs` workers, but a task
+        # can never finish before its most expensive field
+        durations[task] = max(loads[task] / jobs, costs[members].max())
+        manifest = {'task': task,
+                    'cost': loads[task],
+                    'fields': {}}
+        for idx in members:
+            dirname = fields['dir'][idx].strip()
+            manifest['fields'].setdefault(dirname, []).append(
+                field_key(fields['runno_r'][idx].strip(),
+                          fields['field'][idx].strip()))
+        with open(os.path.join(taskdir, 'task-{}.json'.format(task)), 'w') as fh:
+            json.dump(manifest, fh, indent=1, sort_keys=True)
+    log.info("Packed {} fields into {} tasks; estimated cost per task is "
+             "{:.0f}s to {:.0f}s".format(len(fields), ntasks,
+                                         loads.min(), loads.max()))
+
+    filename = os.path.join(taskdir, 'quicklook-array.pbs')
+    with open(filename, 'w') as fh:
+        fh.write(PBS_TEMPLATE.format(
+                    jobs=jobs,
+                    last_task=ntasks - 1,
+                    walltime=format_walltime(safety * durations.max()),
+                    taskdir=os.path.abspath(taskdir)))
+    return filename
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Packs the quicklook fields into a balanced PBS job array.")
+    parser.add_argument("ntasks", type=int, help="number of tasks in the job array")
+    parser.add_argument("--taskdir", default="quicklook-tasks",
+                        help="output directory (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of quicklooks each task computes in parallel")
+    parser.add_argument("--profile", nargs="*", default=[], metavar="FILE",
+                        help="JSON-lines profiles used to estimate field costs")
+    args = parser.parse_args()
+    filename = plan_jobs(args.ntasks, args.taskdir, jobs=args.jobs,
+                         profiles=args.profile)
+    print('qsub -N iphas_ql {}'.format(filename))
@@ -0,0 +1,125 @@
+"""
+Checks which fields of a month can be turned into quicklooks, before any
+work is launched.
+
+The field table is joined against the image index in bulk, i.e. with one
+query per band rather than one per run, and the candidate image and
+confidence map files are then checked for existence by a pool of threads,
+because `stat` calls on a network filesystem are slow but independent.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from astropy.table import Table
+
+
+BANDS = ['u', 'g', 'r']
+THREADS = 16  # Number of concurrent stat calls
+
+
+def resolve(fields, index, bands=BANDS):
+    """Looks up the images and confidence maps of all the fields at once.
+
+    Parameters
+    ----------
+    fields : `~astropy.table.Table`
+        Table with a 'runno_<band>' column for every band.
+
+    index : `imageindex.ImageIndex`
+        Index of image and confidence map locations.
+
+    Returns
+    -------
+    images, confmaps : dict
+        Map bands onto arrays of paths, which are None where unknown.
+
+    reasons : array of object
+        Reason why each field cannot be processed, or None.
+    """
+    reasons = np.full(len(fields), None, dtype=object)
+    images, confmaps = {}, {}
+    for band in bands:
+        runs = np.char.strip(np.asarray(fields['runno_' + band], dtype=str))
+        images[band] = np.full(len(fields), None, dtype=object)
+        confmaps[band] = np.full(len(fields), None, dtype=object)
+
+        has_run = runs != ''
+        _add_reason(reasons, ~has_run, 'no {} run'.format(band))
+        images[band][has_run] = index.paths(runs[has_run].astype(np.int64))
+
+        known = np.array([path is not None for path in images[band]],
+                         dtype=bool)
+        for idx in np.where(has_run & ~known)[0]:
+            _add_reason(reasons, idx,
+                        '{} run {} not in index'.format(band, runs[idx]))
+
+        directories = [os.path.dirname(path) for path in images[band][known]]
+        if len(directories) > 0:
+            confmaps[band][known] = index.confmaps(directories, band)
+        for idx in np.where(known)[0]:
+            if confmaps[band][idx] is None:
+                _add_reason(reasons, idx, '{} conf map missing for {}'.format(
+                                band, os.path.dirname(images[band][idx])))
+    return images, confmaps, reasons
+
+
+def _add_reason(reasons, idx, reason):
+    """Records a reason why fields cannot be processed, unless they
+    already have one; `idx` is an index or a boolean mask."""
+    idx = np.atleast_1d(idx)
+    if idx.dtype == bool:
+        idx = np.where(idx)[0]
+    for i in idx:
+        if reasons[i] is None:
+            reasons[i] = reason
+
+
+def check_files(filenames, threads=THREADS):
+    """Returns {filename: exists} for a collection of files."""
+    filenames = sorted(set(filenames))
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return dict(zip(filenames, pool.map(os.path.exists, filenames)))
+
+
+def plan(fields, index, bands=BANDS, stat=True, threads=THREADS):
+    """Splits a field table into fields which are ready to be processed
+    and fields which are certain to fail.
+
+    Parameters
+    ----------
+    fields : `~astropy.table.Table`
+        Table with a 'runno_<band>' column for every band.
+
+    index : `imageindex.ImageIndex`
+        Index of image and confidence map locations.
+
+    stat : bool
+        If False, only the index is checked, not the filesystem.
+
+    threads : int
+        Number of concurrent stat calls.
+
+    Returns
+    -------
+    ready, missing : `~astropy.table.Table`
+        Subsets of `fields`; `missing` has an extra 'reason' column.
+    """
+    images, confmaps, reasons = resolve(fields, index, bands=bands)
+    if stat:
+        columns = [images[band] for band in bands] + \
+                  [confmaps[band] for band in bands]
+        exists = check_files([path for paths in columns
+                              for path in paths if path is not None],
+                             threads=threads)
+        for paths in columns:
+            for idx, path in enumerate(paths):
+                if path is not None and not exists[path]:
+                    _add_reason(reasons, idx,
+                                'file {} does not exist'.format(path))
+
+    ok = np.array([reason is None for reason in reasons], dtype=bool)
+    ready = Table(fields[ok])
+    missing = Table(fields[~ok])
+    missing['reason'] = np.array([str(r) for r in reasons[~ok]], dtype=str)
+    return ready, missing
@@ -0,0 +1,156 @@
+"""
+Records the time and resources spent in each stage of the quicklook pipeline.
+
+Each stage of each field produces one record, which is appended to a
+JSON-lines file.  The file can be summarized using `summarize-profile.py`.
+
+The peak memory of an in-process stage is that of the whole process during
+the stage, including the peaks of the stages nested in it.  The memory of
+stages which run concurrently in different threads cannot be told apart,
+hence their peak memory is not recorded.
+"""
+import os
+import json
+import time
+import fcntl
+import threading
+import resource
+import contextlib
+
+
+def get_size(filename):
+    """Returns the size of a file in bytes, or zero if it does not exist."""
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def reset_peak_rss():
+    """Resets the peak resident set size of this process (Linux only)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as fh:
+            fh.write('5')
+    except (IOError, OSError):
+        pass  # The peak will be the lifetime peak instead
+
+
+def get_peak_rss():
+    """Returns the peak resident set size of this process in kilobytes."""
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def read_records(filenames):
+    """Returns the records in a list of JSON-lines files."""
+    records = []
+    for filename in filenames:
+        with open(filename) as fh:
+            for line in fh:
+                if line.strip():
+                    records.append(json.loads(line))
+    return records
+
+
+class Profiler(object):
+    """
+    Collects per-stage records for a single field.
+
+    Parameters
+    ----------
+    filename : str
+        JSON-lines file to append the records to.  If None, records are
+        collected but never written.
+
+    **context
+        Key/value pairs to include in every record, e.g. the field id.
+    """
+
+    def __init__(self, filename=None, **context):
+        self.filename = filename
+        self.context = context
+        self.records = []
+        self._lock = threading.Lock()
+        self._open = []  # State of the stages in progress, outermost first
+
+    @contextlib.contextmanager
+    def stage(self, name, inputs=(), outputs=(), **extra):
+        """Context manager which records the duration of a stage.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage, e.g. 'mosaic'.
+
+        inputs, outputs : list of str
+            Files read and written by the stage; their sizes are recorded.
+
+        **extra
+            Additional key/value pairs to record, e.g. the band.
+
+        Yields
+        ------
+        record : dict
+            The record, which the caller may update; e.g. to replace the
+            cpu time and peak memory of this process by those of a command.
+        """
+        record = dict(self.context)
+        record.update(extra)
+        record['stage'] = name
+        record['bytes_read'] = sum(get_size(fn) for fn in inputs)
+        thread = threading.current_thread()
+        state = {'thread': thread, 'concurrent': False, 'child_peak': 0}
+        with self._lock:
+            # The enclosing stages are those in this thread and in the thread
+            # of the outermost stage; stages in other threads run concurrently
+            outer = self._open[0]['thread'] if self._open else thread
+            for other in self._open:
+                if other['thread'] not in (thread, outer):
+                    other['concurrent'] = state['concurrent'] = True
+            if not state['concurrent']:
+                # Hand the peak so far to the enclosing stages before it
+                # is reset, such that their peaks include it
+                peak = get_peak_rss()
+                for other in self._open:
+                    other['child_peak'] = max(other['child_peak'], peak)
+                reset_peak_rss()
+            self._open.append(state)
+        start_time, start_cpu = time.time(), sum(os.times()[:2])
+        try:
+            yield record
+        finally:
+            record['duration'] = time.time() - start_time
+            record.setdefault('cpu_time', sum(os.times()[:2]) - start_cpu)
+            record['bytes_written'] = sum(get_size(fn) for fn in outputs)
+            with self._lock:
+                self._open = [other for other in self._open
+                              if other is not state]
+                if 'peak_rss_kb' not in record and not state['concurrent']:
+                    record['peak_rss_kb'] = max(get_peak_rss(),
+                                                state['child_peak'])
+                # The peak of a stage counts towards those enclosing it
+                for other in self._open:
+                    if other['thread'] in (thread, outer):
+                        other['child_peak'] = max(other['child_peak'],
+                                                  record.get('peak_rss_kb', 0))
+                self.records.append(record)
+
+    def write(self):
+        """Appends the records to the JSON-lines file."""
+        if self.filename is None or len(self.records) == 0:
+            return
+        lines = ''.join(json.dumps(rec, sort_keys=True) + '\n'
+                        for rec in self.records)
+        # Lock the file because many workers may write to it
+        with open(self.filename, 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            fh.write(lines)
+            fh.flush()
+            fcntl.flock(fh, fcntl.LOCK_UN)
+        self.records = []
@@ -0,0 +1,474 @@
+"""
+Renders quicklook JPEGs in-process using NumPy.
+
+This module replaces the `mosaic` -> `mJPEG` -> `convert` sequence of
+commands.  It reads the four CCD extensions of a reduced WFC frame,
+places them on a common pixel grid, applies the [25%, 99.9%] logarithmic
+contrast stretch and writes the JPEGs straight from memory.
+
+Because the small jpegs are only 600 pixels wide, the frames can also be
+read in a memory-bounded, downsample-first mode: the pixel data is
+memory-mapped and block-averaged one chunk of rows at a time, and the
+stretch limits are estimated from a strided sample of the pixels, which is
+taken from the same chunks such that every pixel is only read once.
+Tile-compressed (.fz) frames are read directly, without funpack, by
+decompressing the CCD extensions concurrently and tile by tile.
+
+The colour jpegs are made by resampling the u and g images onto the grid of
+the r image, using the world coordinate system of each band, such that
+bands obtained at slightly different pointings are aligned correctly.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+from PIL import Image
+
+
+VERSION = 3  # Increment whenever a change alters the appearance of the jpegs
+LOW_PERCENTILE = 25.
+HIGH_PERCENTILE = 99.9
+LOG_STRETCH = 1000.  # Steepness of the logarithmic stretching function
+SMALL_WIDTH = 600  # Width of the small jpegs in pixels
+QUALITY = 90  # Quality of the full-size jpegs
+QUALITY_SMALL = 70  # Quality of the small jpegs
+CHUNK_ROWS = 256  # Number of unbinned rows to read into memory at once
+MAX_SAMPLES = 1000000  # Number of pixels used to estimate the stretch limits
+THREADS = 4  # Number of CCD extensions to read concurrently
+EDGE_TOLERANCE = 1e-3  # Pixels by which a resampled position may overshoot
+
+
+def cd_matrix(header):
+    """Returns the CD matrix of a header as a 2x2 array."""
+    return np.array([[header['CD1_1'], header['CD1_2']],
+                     [header['CD2_1'], header['CD2_2']]])
+
+
+def pixel_scale(header):
+    """Returns the pixel scale of a header in degrees per pixel."""
+    return np.sqrt(np.abs(np.linalg.det(cd_matrix(header))))
+
+
+def placement(header, scale):
+    """Returns the position of a CCD on the mosaic grid.
+
+    The mosaic grid is aligned with the tangent plane of the frame (north up,
+    east left) and has pixels of `scale` degrees.  The WFC CCDs are aligned
+    with the tangent plane to within a fraction of a degree, hence a CCD
+    can be placed on the grid by flipping and/or transposing its pixels.
+
+    Returns
+    -------
+    orientation : 2x2 array of int
+        Signed permutation matrix mapping CCD pixel axes onto the grid axes.
+
+    corner : array of float
+        Grid coordinates (u, v) of the lower left corner of the CCD,
+        relative to the tangent point.
+    """
+    # Maps (x, y) pixel offsets onto (u, v) grid offsets
+    transform = np.dot([[-1, 0], [0, 1]], cd_matrix(header)) / scale
+    orientation = np.round(transform).astype(int)
+    nx, ny = header['NAXIS1'], header['NAXIS2']
+    edges = np.array([[0.5, 0.5], [nx + 0.5, 0.5],
+                      [0.5, ny + 0.5], [nx + 0.5, ny + 0.5]])
+    corners = np.dot(edges - [header['CRPIX1'], header['CRPIX2']],
+                     transform.T)
+    return orientation, corners.min(axis=0)
+
+
+def orient(data, orientation):
+    """Flips and/or transposes a CCD array to align it with the grid."""
+    if orientation[0, 0] == 0:
+        data = data.T
+        sign_u, sign_v = orientation[0, 1], orientation[1, 0]
+    else:
+        sign_u, sign_v = orientation[0, 0], orientation[1, 1]
+    if sign_u < 0:
+        data = data[:, ::-1]
+    if sign_v < 0:
+        data = data[::-1, :]
+    return data
+
+
+def grid_wcs(header, scale, origin, factor=1):
+    """Returns the world coordinate system of a mosaic grid.
+
+    The grid is a linear grid in the tangent plane of the frame, hence it is
+    described using a gnomonic (TAN) projection; the radial distortion of
+    the WFC is not modelled, which is adequate for aligning the bands of a
+    field at quicklook resolution.
+
+    Parameters
+    ----------
+    header : `astropy.io.fits.Header`
+        Header of one of the CCDs, which defines the tangent point.
+
+    scale : float
+        Unbinned pixel scale in degrees.
+
+    origin : array of float
+        Grid coordinates (u, v) of the lower left corner of the mosaic.
+
+    factor : int
+        Block-averaging factor of the mosaic.
+    """
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    wcs.wcs.crval = [header['CRVAL1'], header['CRVAL2']]
+    wcs.wcs.crpix = [0.5 - origin[0] / factor, 0.5 - origin[1] / factor]
+    wcs.wcs.cd = [[-scale * factor, 0.], [0., scale * factor]]
+    return wcs
+
+
+def downsample_wcs(wcs, factor):
+    """Returns the world coordinate system of a block-averaged image."""
+    result = wcs.deepcopy()
+    if wcs.wcs.has_cd():
+        result.wcs.cd = wcs.wcs.cd * factor
+    else:
+        result.wcs.cdelt = wcs.wcs.cdelt * factor
+    result.wcs.crpix = (wcs.wcs.crpix - 0.5) / factor + 0.5
+    return result
+
+
+def sample_stride(headers, max_samples=MAX_SAMPLES):
+    """Returns n such that every n-th row and column of the CCDs described
+    by `headers` holds about `max_samples` pixels."""
+    npix = sum(header['NAXIS1'] * header['NAXIS2'] for header in headers)
+    return max(1, int(np.ceil(np.sqrt(npix / float(max_samples)))))
+
+
+def block_average(data, factor, chunk_rows=CHUNK_ROWS, stride=None):
+    """Block-averages a 2D array by an integer factor.
+
+    The array is read one chunk of rows at a time, such that an HDU
+    `section` is never loaded into memory in full.  Rows and columns
+    which do not fill a complete block are discarded.
+
+    If `stride` is given, every `stride`-th row and column of the array is
+    collected from the same chunks, such that a tile-compressed array is
+    only decompressed once.
+
+    Returns
+    -------
+    result : 2D array of float32
+
+    sample : 1D array of float32
+        Only returned if `stride` is given.
+    """
+    ny, nx = data.shape[0] // factor, data.shape[1] // factor
+    result = np.empty((ny, nx), dtype=np.float32)
+    sample = []
+    step = max(1, chunk_rows // factor)  # Output rows per chunk
+    for y0 in range(0, ny, step):
+        y1 = min(ny, y0 + step)
+        chunk = np.asarray(data[y0 * factor:y1 * factor], dtype=np.float32)
+        if stride is not None:
+            first = -y0 * factor % stride  # First sampled row of the chunk
+            sample.append(chunk[first::stride, ::stride].ravel())
+        result[y0:y1] = chunk[:, :nx * factor].reshape(
+                            y1 - y0, factor, nx, factor).mean(axis=(1, 3))
+    if stride is None:
+        return result
+    # Sample the rows which do not fill a complete block as well
+    rest = ny * factor
+    if rest < data.shape[0]:
+        chunk = np.asarray(data[rest:], dtype=np.float32)
+        sample.append(chunk[-rest % stride::stride, ::stride].ravel())
+    return result, np.concatenate(sample)
+
+
+def ccd_extensions(hdulist):
+    """Returns the indices of the image extensions of a WFC frame."""
+    return [idx for idx in range(1, len(hdulist))
+            if hdulist[idx].header.get('NAXIS') == 2]
+
+
+def ccd_hdus(hdulist):
+    """Returns the image extensions of a WFC frame."""
+    return [hdulist[idx] for idx in ccd_extensions(hdulist)]
+
+
+def mosaic_width(filename):
+    """Returns the width of the mosaic of a frame in unbinned pixels."""
+    with fits.open(filename) as hdulist:
+        ccds = ccd_hdus(hdulist)
+        scale = pixel_scale(ccds[0].header)
+        left, right = [], []
+        for hdu in ccds:
+            orientation, corner = placement(hdu.header, scale)
+            width = hdu.header['NAXIS1']
+            if orientation[0, 0] == 0:
+                width = hdu.header['NAXIS2']
+            left.append(corner[0])
+            right.append(corner[0] + width)
+    return int(round(max(right) - min(left)))
+
+
+def read_ccd(filename, extension, factor=1, chunk_rows=CHUNK_ROWS,
+             stride=1):
+    """Reads and block-averages a single CCD extension.
+
+    The pixels are read through the `section` interface, hence only the
+    tiles of a tile-compressed (.fz) extension which are needed for each
+    chunk are decompressed.  The file is opened by this function, such that
+    several extensions can be read concurrently from different threads.
+
+    Returns
+    -------
+    data, sample : 2D array of float32, 1D array of float32
+        The block-averaged CCD, and every `stride`-th row and column of
+        its unbinned pixels.
+    """
+    with fits.open(filename, memmap=True) as hdulist:
+        return block_average(hdulist[extension].section, factor,
+                             chunk_rows=chunk_rows, stride=stride)
+
+
+def read_mosaic(filename, factor=1, chunk_rows=CHUNK_ROWS,
+                threads=THREADS, max_samples=MAX_SAMPLES):
+    """Reads the CCDs of a WFC frame and places them on a common grid.
+
+    Both uncompressed and tile-compressed (fpack'ed) frames are supported.
+
+    Parameters
+    ----------
+    filename : str
+        Path to a multi-extension FITS file.
+
+    factor : int
+        Block-averaging factor; the mosaic will have 1/factor times
+        the number of pixels along each axis.
+
+    chunk_rows : int
+        Number of unbinned rows to read into memory at once.
+
+    threads : int
+        Number of CCDs to read (and decompress) concurrently.
+
+    max_samples : int
+        Approximate number of unbinned pixels to return in `sample`.
+
+    Returns
+    -------
+    mosaic : 2D array of float32
+        Pixel data, with NaN in the gaps between the CCDs.  The first row
+        is the southern edge of the field (FITS convention).
+
+    wcs : `astropy.wcs.WCS`
+        World coordinate system of the mosaic.
+
+    sample : 1D array of float32
+        Every n-th row and column of the unbinned CCDs, from which the
+        stretch limits can be estimated.
+    """
+    with fits.open(filename) as hdulist:
+        extensions = ccd_extensions(hdulist)
+        headers = [hdulist[idx].header.copy() for idx in extensions]
+    scale = pixel_scale(headers[0])
+    placements = [placement(header, scale) for header in headers]
+    origin = np.min([corner for _, corner in placements], axis=0)
+
+    # Determine the size of the grid before reading any pixels
+    offsets, shapes = [], []
+    for header, (orientation, corner) in zip(headers, placements):
+        offsets.append(np.round((corner - origin) / factor).astype(int))
+        shape = (header['NAXIS2'] // factor, header['NAXIS1'] // factor)
+        if orientation[0, 0] == 0:
+            shape = shape[::-1]
+        shapes.append(shape)
+    height = max(off[1] + shape[0] for off, shape in zip(offsets, shapes))
+    width = max(off[0] + shape[1] for off, shape in zip(offsets, shapes))
+
+    stride = sample_stride(headers, max_samples)
+
+    def paste(extension, orientation, offset):
+        data, sample = read_ccd(filename, extension, factor, chunk_rows,
+                                stride)
+        data = orient(data, orientation)
+        u0, v0 = offset
+        mosaic[v0:v0 + data.shape[0], u0:u0 + data.shape[1]] = data
+        return sample
+
+    mosaic = np.full((height, width), np.nan, dtype=np.float32)
+    orientations = [orientation for orientation, _ in placements]
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            # list() re-raises the first exception, if any
+            samples = list(pool.map(paste, extensions, orientations, offsets))
+    else:
+        samples = [paste(*args)
+                   for args in zip(extensions, orientations, offsets)]
+    return (mosaic, grid_wcs(headers[0], scale, origin, factor),
+            np.concatenate(samples))
+
+
+def percentile_limits(data, low=LOW_PERCENTILE, high=HIGH_PERCENTILE):
+    """Returns the pixel values at the given percentiles, ignoring NaNs."""
+    finite = data[np.isfinite(data)]
+    return np.percentile(finite, [low, high])
+
+
+def stretch(data, vmin, vmax):
+    """Applies the logarithmic contrast stretch.
+
+    Pixel values are clipped and normalized to the [vmin, vmax] interval,
+    after which the function log10(1 + a*x) / log10(1 + a) is applied.
+
+    Returns
+    -------
+    image : array of uint8
+        Gray levels; NaN pixels are shown in black.
+    """
+    image = np.subtract(data, vmin, dtype=np.float32)
+    image /= (vmax - vmin)
+    np.clip(image, 0., 1., out=image)
+    image[~np.isfinite(image)] = 0.
+    image *= LOG_STRETCH
+    np.log1p(image, out=image)
+    image *= 255. / np.log1p(LOG_STRETCH)
+    image += 0.5
+    return image.astype(np.uint8)
+
+
+def write_jpeg(image, filename, width=None, quality=QUALITY):
+    """Writes a gray (2D) or colour (3D) uint8 array to a JPEG file.
+
+    The first row of the array is shown at the bottom of the image.
+    If `width` is given, the image is resized to that number of pixels.
+    """
+    img = Image.fromarray(np.ascontiguousarray(image[::-1]))
+    if width is not None:
+        height = int(round(img.size[1] * width / float(img.size[0])))
+        img = img.resize((width, height), Image.LANCZOS)
+    img.save(filename, quality=quality)
+
+
+def read_jpeg(filename):
+    """Reads a gray JPEG file, e.g. one made by mJPEG, into a uint8 array.
+
+    The bottom row of the image becomes the first row of the array, as
+    expected by `write_jpeg`.
+    """
+    with Image.open(filename) as img:
+        image = np.asarray(img.convert('L'))
+    return image[::-1]
+
+
+def read_band(filename, width=None):
+    """Reads a single-band frame and determines its stretch limits.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the frame.
+
+    width : int
+        If given, the frame is read in the memory-bounded downsample-first
+        mode, yielding a mosaic which is at least `width` pixels wide.
+
+    Returns
+    -------
+    mosaic, limits, wcs : 2D array of float32, (vmin, vmax), `WCS`
+    """
+    if width is None:
+        mosaic, wcs, _ = read_mosaic(filename)
+        limits = percentile_limits(mosaic)
+    else:
+        # The stretch limits are estimated from a strided sample of the
+        # unbinned pixels, which is collected while the mosaic is read
+        factor = max(1, mosaic_width(filename) // width)
+        mosaic, wcs, sample = read_mosaic(filename, factor=factor)
+        limits = percentile_limits(sample)
+    return mosaic, limits, wcs
+
+
+def write_band(mosaic, limits, filename_jpg_small, filename_jpg=None):
+    """Stretches a mosaic and writes the small and full-size jpegs.
+
+    The full-size jpeg is only written if `filename_jpg` is given.
+
+    Returns
+    -------
+    image : array of uint8
+        The stretched image.
+    """
+    image = stretch(mosaic, limits[0], limits[1])
+    if filename_jpg is not None:
+        write_jpeg(image, filename_jpg)
+    write_jpeg(image, filename_jpg_small, width=SMALL_WIDTH,
+               quality=QUALITY_SMALL)
+    return image
+
+
+def interpolate(image, x, y, tolerance=EDGE_TOLERANCE):
+    """Bilinear interpolation of an image at 0-based pixel coordinates.
+
+    Positions which fall outside the image by more than `tolerance` pixels
+    are given the value zero; positions within the tolerance are clamped
+    onto the edge, such that round-off errors do not blank the border.
+    """
+    ny, nx = image.shape
+    outside = ~(np.isfinite(x) & np.isfinite(y))
+    outside |= (x < -tolerance) | (x > nx - 1 + tolerance)
+    outside |= (y < -tolerance) | (y > ny - 1 + tolerance)
+    x = np.clip(np.where(outside, 0., x), 0, nx - 1)
+    y = np.clip(np.where(outside, 0., y), 0, ny - 1)
+    # The last row and column are reached with a weight of one
+    x0 = np.minimum(np.floor(x).astype(int), nx - 2)
+    y0 = np.minimum(np.floor(y).astype(int), ny - 2)
+    dx, dy = x - x0, y - y0
+    result = (image[y0, x0] * (1 - dx) * (1 - dy)
+              + image[y0, x0 + 1] * dx * (1 - dy)
+              + image[y0 + 1, x0] * (1 - dx) * dy
+              + image[y0 + 1, x0 + 1] * dx * dy)
+    result[outside] = 0.
+    return result
+
+
+def reproject(image, wcs, wcs_out, shape_out):
+    """Resamples an image onto the grid of another world coordinate system."""
+    y, x = np.mgrid[0:shape_out[0], 0:shape_out[1]]
+    ra, dec = wcs_out.wcs_pix2world(x, y, 0)
+    x_in, y_in = wcs.wcs_world2pix(ra, dec, 0)
+    return interpolate(image, x_in, y_in)
+
+
+def downsample(image, wcs, width=SMALL_WIDTH):
+    """Block-averages an image and its WCS to at least `width` pixels wide."""
+    factor = max(1, image.shape[1] // width)
+    if factor == 1:
+        return image.astype(np.float32), wcs
+    return block_average(image, factor), downsample_wcs(wcs, factor)
+
+
+def render_colour(red, green, blue, filename_jpg_small, width=SMALL_WIDTH):
+    """Combines three stretched images into a colour jpeg.
+
+    Each image is first brought to quicklook resolution.  The green and
+    blue images are then resampled onto the grid of the red image using
+    their world coordinate systems.
+
+    Parameters
+    ----------
+    red, green, blue : (image, wcs) tuples
+        Stretched images (arrays of uint8) and their world coordinate
+        systems, as returned by `write_band` and `read_band`.
+
+    filename_jpg_small : str
+        Output filename.
+
+    width : int
+        Width of the jpeg in pixels.
+    """
+    image_r, wcs_r = downsample(red[0], red[1], width)
+    channels = [image_r]
+    for image, wcs in [green, blue]:
+        image, wcs = downsample(image, wcs, width)
+        channels.append(reproject(image, wcs, wcs_r, image_r.shape))
+    image = np.dstack(channels)
+    image += 0.5
+    write_jpeg(image.clip(0, 255).astype(np.uint8), filename_jpg_small,
+               width=width, quality=QUALITY_SMALL)
@@ -0,0 +1,70 @@
+"""
+Summarizes the per-stage timings recorded by `create-quicklooks.py --profile`.
+
+For every stage, the durations of all the invocations made for a field (e.g.
+one per band) are added up, and percentiles are computed across fields.
+"""
+from collections import defaultdict
+
+import numpy as np
+
+from profiling import read_records
+
+
+PERCENTILES = [50, 90, 99]
+
+
+def aggregate(records, dirname=None):
+    """Returns {stage: {quantity: array}} with one value per field.
+
+    Durations, cpu times and bytes are summed per field,
+    whereas the peak memory is the maximum per field.
+    """
+    per_field = defaultdict(lambda: defaultdict(lambda: defaultdict(float)))
+    for rec in records:
+        if dirname is not None and rec.get('dir') != dirname:
+            continue
+        totals = per_field[rec['stage']][(rec['run_r'], rec['fieldid'])]
+        for key in ['duration', 'cpu_time', 'bytes_read', 'bytes_written']:
+            totals[key] += rec.get(key, 0)
+        totals['peak_rss_kb'] = max(totals['peak_rss_kb'],
+                                    rec.get('peak_rss_kb', 0))
+    result = {}
+    for stage, fields in per_field.items():
+        result[stage] = {key: np.array([totals[key]
+                                        for totals in fields.values()])
+                         for key in ['duration', 'cpu_time', 'bytes_read',
+                                     'bytes_written', 'peak_rss_kb']}
+    return result
+
+
+def print_summary(stats):
+    """Prints a table of percentiles per stage, slowest stage first."""
+    header = '{:<10s} {:>6s} {:>9s} '.format('stage', 'fields', 'total[s]')
+    header += ' '.join('{:>8s}'.format('p{}[s]'.format(p))
+                       for p in PERCENTILES)
+    header += ' {:>8s} {:>9s} {:>9s} {:>9s}'.format(
+                    'cpu[s]', 'read[MB]', 'write[MB]', 'rss[MB]')
+    print(header)
+    order = sorted(stats, key=lambda stage: -stats[stage]['duration'].sum())
+    for stage in order:
+        st = stats[stage]
+        line = '{:<10s} {:>6d} {:>9.1f} '.format(stage, st['duration'].size,
+                                                 st['duration'].sum())
+        line += ' '.join('{:>8.2f}'.format(v)
+                         for v in np.percentile(st['duration'], PERCENTILES))
+        line += ' {:>8.2f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+                    np.median(st['cpu_time']),
+                    np.median(st['bytes_read']) / 1e6,
+                    np.median(st['bytes_written']) / 1e6,
+                    np.max(st['peak_rss_kb']) / 1e3)
+        print(line)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Prints per-stage percentiles of quicklook timings.")
+    parser.add_argument("filenames", nargs="+", help="JSON-lines profile files")
+    parser.add_argument("--dir", help="only include fields from this month directory")
+    args = parser.parse_args()
+    print_summary(aggregate(read_records(args.filenames), dirname=args.dir))
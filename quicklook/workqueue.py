@@ -0,0 +1,190 @@
+"""
+Work queue from which any number of quicklook workers claim fields.
+
+The queue is an SQLite database, typically on the shared filesystem, with
+one row per field.  Workers claim fields one at a time inside an exclusive
+transaction, so that no field is ever handed out twice.  While a worker
+processes a field it renews its lease by sending heartbeats; a field whose
+lease has expired, e.g. because its node died, is handed out again.  Fields
+which fail are retried until they have been attempted `max_attempts` times.
+
+Note that SQLite relies on the filesystem's POSIX locks, which NFS only
+supports if the lock daemon is running.
+"""
+import time
+import sqlite3
+import threading
+import contextlib
+
+
+LEASE = 600.  # Seconds after the last heartbeat at which a claim expires
+MAX_ATTEMPTS = 3
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+class WorkQueue(object):
+    """
+    Queue of (dir, key) tasks, where key identifies a field within a month.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the SQLite database; it is created if necessary.
+
+    lease : float
+        Number of seconds after the last heartbeat at which a claim expires.
+
+    max_attempts : int
+        Number of times a field is attempted before it is marked as failed.
+    """
+
+    def __init__(self, filename, lease=LEASE, max_attempts=MAX_ATTEMPTS):
+        self.filename = filename
+        self.lease = lease
+        self.max_attempts = max_attempts
+        with self._transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS tasks "
+                         "(dir TEXT, key TEXT, state TEXT NOT NULL, "
+                         "worker TEXT, heartbeat REAL, "
+                         "attempts INTEGER NOT NULL DEFAULT 0, error TEXT, "
+                         "PRIMARY KEY (dir, key))")
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_state "
+                         "ON tasks (state)")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Yields a connection holding the database's write lock."""
+        conn = sqlite3.connect(self.filename, timeout=60,
+                               isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def fill(self, dirname, keys):
+        """Adds fields to the queue; fields already queued are left as is.
+
+        Returns
+        -------
+        count : int
+            Number of fields added.
+        """
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO tasks (dir, key, state) "
+                             "VALUES (?, ?, ?)",
+                             ((dirname, key, PENDING) for key in keys))
+            return conn.total_changes - before
+
+    def claim(self, worker):
+        """Claims a pending field, or one whose lease has expired.
+
+        Returns
+        -------
+        task : (dir, key) tuple, or None if there is nothing left to claim.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            # Expired claims without attempts left will never be retried
+            conn.execute("UPDATE tasks SET state = ?, error = ? "
+                         "WHERE state = ? AND heartbeat < ? AND attempts >= ?",
+                         (FAILED, 'lease expired', RUNNING, now - self.lease,
+                          self.max_attempts))
+            row = conn.execute(
+                        "SELECT dir, key FROM tasks "
+                        "WHERE (state = ? OR (state = ? AND heartbeat < ?)) "
+                        "AND attempts < ? ORDER BY attempts LIMIT 1",
+                        (PENDING, RUNNING, now - self.lease,
+                         self.max_attempts)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE tasks SET state = ?, worker = ?, "
+                         "heartbeat = ?, attempts = attempts + 1 "
+                         "WHERE dir = ? AND key = ?",
+                         (RUNNING, worker, now) + tuple(row))
+            return tuple(row)
+
+    def heartbeat(self, worker, task):
+        """Renews the lease of a claimed field.
+
+        Returns
+        -------
+        owned : bool
+            False if the claim expired and the field was handed to another
+            worker in the meantime.
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE tasks SET heartbeat = ? "
+                                  "WHERE dir = ? AND key = ? AND worker = ? "
+                                  "AND state = ?",
+                                  (time.time(),) + tuple(task) + (worker, RUNNING))
+            return cursor.rowcount > 0
+
+    @contextlib.contextmanager
+    def leased(self, worker, task):
+        """Context manager which sends heartbeats while a field is processed."""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease / 4.):
+                self.heartbeat(worker, task)
+
+        thread = threading.Thread(target=beat)
+        thread.daemon = True
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def release(self, worker, task, error=None):
+        """Marks a claimed field as done, or as failed if `error` is given.
+
+        Failed fields are put back in the queue unless they have used up
+        their attempts.
+        """
+        with self._transaction() as conn:
+            if error is None:
+                conn.execute("UPDATE tasks SET state = ?, error = NULL "
+                             "WHERE dir = ? AND key = ? AND worker = ?",
+                             (DONE,) + tuple(task) + (worker,))
+            else:
+                conn.execute("UPDATE tasks SET error = ?, "
+                             "state = CASE WHEN attempts < ? THEN ? ELSE ? END "
+                             "WHERE dir = ? AND key = ? AND worker = ?",
+                             (str(error), self.max_attempts, PENDING, FAILED)
+                             + tuple(task) + (worker,))
+
+    def counts(self):
+        """Returns {state: number of fields}."""
+        with self._transaction() as conn:
+            return dict(conn.execute("SELECT state, COUNT(*) FROM tasks "
+                                     "GROUP BY state").fetchall())
+
+    def failures(self):
+        """Returns a list of (dir, key, attempts, error) of failed fields."""
+        with self._transaction() as conn:
+            return conn.execute("SELECT dir, key, attempts, error FROM tasks "
+                                "WHERE state = ? ORDER BY dir, key",
+                                (FAILED,)).fetchall()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Prints the state of a quicklook work queue.")
+    parser.add_argument("filename")
+    args = parser.parse_args()
+    queue = WorkQueue(args.filename)
+    for state, count in sorted(queue.counts().items()):
+        print('{:<8s} {:>6d}'.format(state, count))
+    for dirname, key, attempts, error in queue.failures():
+        print('Failed: {} {} after {} attempts: {}'.format(dirname, key,
+                                                           attempts, error))